@@ -0,0 +1,86 @@
+"""
+Shared aiohttp client for the asyncio code paths (async_app.py).
+
+Only imported from inside async functions, so the Flask app and the Kivy
+client never need aiohttp installed.
+"""
+import json
+import asyncio
+import aiohttp
+from yarl import URL
+
+# The point of the async path is holding many slow upstream calls open at
+# once, so the connection pool is far larger than any thread pool here
+MAX_CONNECTIONS = 1000
+MAX_PER_HOST = 100
+
+_sessions = {} # event loop -> ClientSession
+
+
+class Response:
+    """The parts of a requests.Response the engines use."""
+    def __init__(self, status_code, content, headers, encoding='utf-8'):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+        self.encoding = encoding
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, errors='replace')
+
+    def json(self):
+        return json.loads(self.text)
+
+
+def session():
+    """ClientSession for the running event loop (created on first use)."""
+    loop = asyncio.get_running_loop()
+    s = _sessions.get(loop)
+    if s is None or s.closed:
+        connector = aiohttp.TCPConnector(limit=MAX_CONNECTIONS, limit_per_host=MAX_PER_HOST)
+        s = _sessions[loop] = aiohttp.ClientSession(connector=connector)
+    return s
+
+
+async def close():
+    s = _sessions.pop(asyncio.get_running_loop(), None)
+    if s:
+        await s.close()
+
+
+def _url(url, params):
+    # Merge like requests does (DDG's next-page URL already has a query)
+    return URL(url).update_query(params) if params else URL(url)
+
+
+async def get(url, params=None, headers=None, timeout=10):
+    """GET and read the whole body."""
+    async with session().get(_url(url, params), headers=headers,
+                             timeout=aiohttp.ClientTimeout(total=timeout)) as res:
+        return Response(res.status, await res.read(), res.headers, res.charset or 'utf-8')
+
+
+async def get_prefix(url, max_bytes, headers=None, timeout=5):
+    """(status, first max_bytes of the body); the rest is never read."""
+    async with session().get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=timeout)) as res:
+        if res.status not in (200, 206):
+            return res.status, b''
+        data = b''
+        async for chunk in res.content.iter_chunked(4096):
+            data += chunk
+            if len(data) >= max_bytes:
+                break
+        return res.status, data
+
+
+async def stream(url, headers=None, timeout=15, chunk_size=8192):
+    """
+    Async generator of body chunks; raises on HTTP errors. The timeout is
+    per connect/read like requests', so large files are not cut off.
+    """
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=timeout, sock_read=timeout)
+    async with session().get(url, headers=headers, timeout=timeout) as res:
+        res.raise_for_status()
+        async for chunk in res.content.iter_chunked(chunk_size):
+            yield chunk
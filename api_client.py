@@ -1,89 +1,183 @@
 import time
+import json
+import asyncio
 import requests
 import threading
+import xml.etree.ElementTree as ET
+from flows import io, run, run_async
+from metrics import LIMITER_WAIT, LIMITER_QUEUE, UPSTREAM_429, ENGINE_ERRORS
 
 class Rule34Client:
-    def __init__(self, api_key=None, user_id=None):
+    def __init__(self, api_key=None, user_id=None, base_url="https://api.rule34.xxx/index.php"):
         self.api_key = api_key
         self.user_id = user_id
+        self.base_url = base_url
         # Shared lock for throttling across threads
         self.lock = threading.Lock()
         self.last_request_time = 0
         self.min_delay = 1.1 # 1.1s to be safe (limit is 1s)
+        self.backoff = 5 # Pause after a 429
         
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         }
 
-    def _wait_for_slot(self):
-        """Block until safe to make a request."""
+    def _reserve_slot(self):
+        """Claim the next free request slot; returns seconds until it starts."""
         with self.lock:
             now = time.time()
-            elapsed = now - self.last_request_time
-            if elapsed < self.min_delay:
-                sleep_time = self.min_delay - elapsed
-                print(f"[API] Throttling: Sleeping {sleep_time:.2f}s...")
-                time.sleep(sleep_time)
-            
-            self.last_request_time = time.time()
+            slot = max(now, self.last_request_time + self.min_delay)
+            self.last_request_time = slot
+            return slot - now
 
-    def search(self, tags, page=0, limit=20):
-        url = "https://api.rule34.xxx/index.php"
+    def _wait_for_slot(self):
+        """Block until safe to make a request."""
+        start = time.monotonic()
+        LIMITER_QUEUE.inc()
+        try:
+            time.sleep(self._reserve_slot())
+        finally:
+            LIMITER_QUEUE.dec()
+            LIMITER_WAIT.observe(time.monotonic() - start)
+
+    async def _wait_for_slot_async(self):
+        """Same slots as _wait_for_slot, so threads and coroutines share the limit."""
+        start = time.monotonic()
+        LIMITER_QUEUE.inc()
+        try:
+            await asyncio.sleep(self._reserve_slot())
+        finally:
+            LIMITER_QUEUE.dec()
+            LIMITER_WAIT.observe(time.monotonic() - start)
+
+    def _params(self, page, limit, s='post', **extra):
+        """Query string for a dapi listing (s='post' or 'tag') plus extra fields."""
         params = {
             'page': 'dapi',
-            's': 'post',
+            's': s,
             'q': 'index',
-            'json': 1,
             'limit': limit,
             'pid': page,
-            'tags': tags
         }
+        params.update(extra)
         
         if self.api_key and self.user_id:
             params['api_key'] = self.api_key
             params['user_id'] = self.user_id
+        return params
+
+    def search(self, tags, page=0, limit=20):
+        return self._make_request(self.base_url, self._params(page, limit, json=1, tags=tags))
+
+    async def search_async(self, tags, page=0, limit=20):
+        return await self._make_request_async(self.base_url, self._params(page, limit, json=1, tags=tags))
+
+    def tags(self, page=0, limit=1000, names=None):
+        """
+        One page of the site's tag list: [{'name', 'count', 'id'}, ...], or
+        None if it could not be fetched ([] means past the last page).
+        names=[...] looks up just those tags instead.
+        """
+        return run(self._tags(page, limit, names))
+
+    async def tags_async(self, page=0, limit=1000, names=None):
+        return await run_async(self._tags(page, limit, names))
+
+    def _tags(self, page, limit, names):
+        params = self._params(page, limit, s='tag')
+        if names:
+            params['names'] = ' '.join(names)
+        tags = yield from self._request(self.base_url, params, 3, self._parse_tags, lambda: False)
+        return None if tags is False else tags
+
+    def _parse_tags(self, res):
+        """Tags from a response; None to retry a 429, False if the page failed."""
+        if res.status_code != 200:
+            # None (retry) for a 429, otherwise the page failed
+            return None if self._failed(res) is None else False
+        body = res.text.strip()
+        if not body:
+            return []
+        try:
+            if body.startswith('['):
+                items = json.loads(body)
+            else:
+                # The tag endpoint answers in XML; errors come as <response success="false">
+                root = ET.fromstring(body)
+                if root.tag != 'tags':
+                    raise ValueError(f"unexpected <{root.tag}> document")
+                items = [tag.attrib for tag in root.iter('tag')]
+            return [{'name': t['name'], 'count': int(t.get('count', 0)), 'id': int(t.get('id', 0))}
+                    for t in items if t.get('name')]
+        except Exception as e:
+            ENGINE_ERRORS.inc('rule34')
+            print(f"[API] Tag Parse Error: {e}, Text: {body[:100]}")
+            return False
+
+    def _parse(self, res):
+        """Posts from a response, or None if it was a 429 worth retrying."""
+        if res.status_code == 200:
+            # Check for empty response (common on last page)
+            if not res.text.strip():
+                return []
             
-        return self._make_request(url, params)
+            try:
+                data = res.json()
+                if isinstance(data, list):
+                    return data
+                elif isinstance(data, dict):
+                     # Sometimes API returns error dict
+                     print(f"[API] Response Dict: {data}")
+                     return []
+            except Exception as e:
+                # Sometimes XML error is returned despite json=1 if auth fails
+                print(f"[API] JSON Parse Error: {e}, Text: {res.text[:100]}")
+            return []
+        return self._failed(res)
+
+    def _failed(self, res):
+        """None to retry a 429, [] for any other error status."""
+        if res.status_code == 429:
+            UPSTREAM_429.inc('rule34')
+            print(f"[API] 429 Too Many Requests. Backing off...")
+            return None
+        
+        ENGINE_ERRORS.inc('rule34')
+        print(f"[API] Error {res.status_code}")
+        return []
 
-    def _make_request(self, url, params, retries=3):
+    def _request(self, url, params, retries, parse, failed):
+        """Rate-limited GET with retries (a flow, see flows.py)."""
         for attempt in range(retries):
-            self._wait_for_slot()
+            yield io(self._wait_for_slot, self._wait_for_slot_async)
             
             try:
                 print(f"[API] Fetching (Attempt {attempt+1}): {params.get('tags')}")
-                res = requests.get(url, params=params, headers=self.headers, timeout=15)
-                
-                if res.status_code == 200:
-                    # Check for empty response (common on last page)
-                    if not res.text.strip():
-                        return []
-                    
-                    try:
-                        data = res.json()
-                        if isinstance(data, list):
-                            return data
-                        elif isinstance(data, dict):
-                             # Sometimes API returns error dict
-                             print(f"[API] Response Dict: {data}")
-                             return []
-                    except Exception as e:
-                        # Sometimes XML error is returned despite json=1 if auth fails
-                        print(f"[API] JSON Parse Error: {e}, Text: {res.text[:100]}")
-                        return []
-                
-                elif res.status_code == 429:
-                    print(f"[API] 429 Too Many Requests. Backing off...")
-                    time.sleep(5) # Long pause for backoff
-                    continue # Retry
-                
-                else:
-                    print(f"[API] Error {res.status_code}")
-                    return []
+                res = yield io(self._get, self._get_async, url, params)
+                data = parse(res)
+                if data is not None:
+                    return data
+                yield io(time.sleep, asyncio.sleep, self.backoff) # Long pause for backoff
                     
             except Exception as e:
+                ENGINE_ERRORS.inc('rule34')
                 print(f"[API] Network Error: {e}")
                 
-        return []
+        return failed()
+
+    def _make_request(self, url, params, retries=3, parse=None, failed=list):
+        """parse(res) defaults to _parse; failed() is returned if every attempt fails."""
+        return run(self._request(url, params, retries, parse or self._parse, failed))
+
+    async def _make_request_async(self, url, params, retries=3, parse=None, failed=list):
+        return await run_async(self._request(url, params, retries, parse or self._parse, failed))
+
+    def _get(self, url, params):
+        return requests.get(url, params=params, headers=self.headers, timeout=15)
+
+    async def _get_async(self, url, params):
+        import aio_http
+        return await aio_http.get(url, params=params, headers=self.headers, timeout=15)
 
 # Singleton instance for global use
 # User provided: &api_key=7270189f5823ed0a95585e2a16dd3cf4dad5e9a2fba1b54f2a6ca89ed52fe57d418619766eac1b050a4a37a9d3a1a773db3a61d5eb9ac5550168f810ca2a1eaf&user_id=5896660
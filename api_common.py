@@ -0,0 +1,141 @@
+"""
+Framework-neutral pieces of the search API, shared by the Flask app (app.py)
+and the aiohttp app (async_app.py) so both answer with the same payloads,
+encodings and validators. Each app only adapts them to its request and
+response objects.
+"""
+import os
+import gzip
+import zlib
+import time
+import uuid
+import hashlib
+import metrics
+import cursors
+from results import Result
+from page_parsers import PARSE_POOL
+from tag_index import TAG_INDEX
+
+# JSON bodies smaller than this are sent uncompressed
+MIN_COMPRESS_SIZE = 512
+# Routes answering conditional requests (same names in both apps)
+ETAG_ENDPOINTS = {'search_images', 'search_more'}
+# Seconds an interactive request may wait for a transfer slot before a 503
+PROXY_QUEUE_TIMEOUT = 30
+
+
+def configure_parse_pool():
+    """
+    Parse Bing/Yandex pages in worker processes so their regex scans don't
+    hold the GIL against other requests (Q8_PARSE_WORKERS=0 parses inline).
+    One core is left to the server; on a single core workers only add IPC.
+    """
+    if 'Q8_PARSE_WORKERS' not in os.environ:
+        PARSE_POOL.workers = min(4, (os.cpu_count() or 1) - 1)
+
+
+# --- Response bodies ---
+
+def choose_encoding(body, accept_encodings):
+    """'gzip', 'deflate' or None for a body, given the parsed Accept-Encoding."""
+    if len(body) < MIN_COMPRESS_SIZE:
+        return None
+    return accept_encodings.best_match(['gzip', 'deflate'])
+
+
+def body_etag(body, encoding):
+    etag = hashlib.sha1(body).hexdigest()[:24]
+    if encoding:
+        # Strong validators must differ between encodings
+        etag = f"{etag}-{encoding}"
+    return etag
+
+
+def wants_etag(endpoint, args):
+    """
+    Only cursor pages get an ETag: their body depends on the request alone.
+    Session pages carry a fresh session_id or the session's next page, so
+    they could never be revalidated.
+    """
+    return endpoint in ETAG_ENDPOINTS and (args.get('paging') == 'cursor' or bool(args.get('cursor')))
+
+
+def is_not_modified(etag, if_none_match):
+    return if_none_match.contains(etag) or if_none_match.star_tag
+
+
+def compress(body, encoding):
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=6, mtime=0)
+    if encoding == 'deflate':
+        return zlib.compress(body, 6)
+    return body
+
+
+# --- Payloads ---
+
+def encode_results(results, fmt=None, fields=None):
+    """
+    Rows of compact objects, or one columnar object with format=columnar.
+    fields is the comma-separated `fields` parameter naming optional fields
+    to add (id, score, tags).
+    """
+    wanted = Result.json_fields(fields.split(',') if fields else ())
+    if fmt == 'columnar':
+        return Result.columnar(results, wanted)
+    return [r.to_json(wanted) for r in results]
+
+
+def cursor_page(gen, results, fmt=None, fields=None):
+    """
+    Encoded results of one upstream page plus a signed cursor for the next
+    (stateless mode). Pages are served whole so the cursor never has to
+    carry buffered items.
+    """
+    cursor = cursors.encode(gen.get_state()) if results else None
+    return encode_results(results, fmt, fields), cursor
+
+
+def unknown_tags(query):
+    """400 payload naming tags the tag index knows don't exist, else None."""
+    return _unknown_tags_payload(TAG_INDEX.invalid_tags(query))
+
+
+async def unknown_tags_async(query):
+    return _unknown_tags_payload(await TAG_INDEX.invalid_tags_async(query))
+
+
+def _unknown_tags_payload(invalid):
+    if not invalid:
+        return None
+    metrics.TAGS_REJECTED.inc()
+    return {
+        'error': 'Unknown tags',
+        'invalid_tags': invalid,
+        'suggestions': {tag: TAG_INDEX.suggest(tag) for tag in invalid},
+    }
+
+
+def tag_completions(prefix, limit):
+    """Rule34 tag completions from the local tag index; never calls upstream."""
+    start = time.perf_counter()
+    tags = TAG_INDEX.complete_prefix(prefix, limit)
+    took_us = (time.perf_counter() - start) * 1e6
+    return {'prefix': prefix, 'tags': [{'name': n, 'count': c} for n, c in tags], 'took_us': round(took_us, 1)}
+
+
+# --- Transfers ---
+
+def transfer_owner(remote, *session_ids):
+    """Fair-queuing key: the first search session given, else the client address."""
+    return next((s for s in session_ids if s), remote)
+
+
+def proxy_filename(url):
+    # Extract filename
+    filename = url.split('/')[-1].split('?')[0]
+    if not filename or len(filename) > 50:
+        filename = f"image_{uuid.uuid4().hex[:8]}.jpg"
+    # Ensure it has an extension
+    if '.' not in filename: filename += ".jpg"
+    return filename
@@ -1,316 +1,169 @@
 import os
+import time
 import requests
 import uuid
-import re
-import json
+import threading
 from flask import Flask, render_template, request, jsonify, Response
 from concurrent.futures import ThreadPoolExecutor
+from search_logic import get_engine, engine_from_state
+from zip_stream import stream_zip
+from downloader import counted, download_single_image
+from bandwidth import SCHEDULER, QueueTimeout
+from local_index import LOCAL_INDEX
+from watchlist import WATCHLIST
+from tag_index import TAG_INDEX
+import api_common
+import metrics
+import cursors
 
 app = Flask(__name__)
-DOWNLOAD_FOLDER = os.path.join(os.getcwd(), 'downloads')
-
-if not os.path.exists(DOWNLOAD_FOLDER):
-    os.makedirs(DOWNLOAD_FOLDER)
 
+api_common.configure_parse_pool()
 
 # Global cache for search generators
 # format: { 'uuid': generator_object }
 SEARCH_SESSIONS = {}
 
-class SearchEngine:
-    def __init__(self, query):
-        self.query = query
-        self.offset = 0
-        self.headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
+# Upper bound on images per ZIP export
+MAX_EXPORT_URLS = 500
+metrics.SESSIONS.func = lambda: len(SEARCH_SESSIONS)
 
-    def __iter__(self):
-        return self
+# Held by the one process on this host that polls upstream in the background
+BACKGROUND_LOCK_PATH = os.environ.get('Q8_BACKGROUND_LOCK', os.path.join(os.getcwd(), 'background.lock'))
+# Q8_BACKGROUND_WORKERS=0 keeps this process from ever polling (benchmarks,
+# or every host but one)
+BACKGROUND_WORKERS = os.environ.get('Q8_BACKGROUND_WORKERS', '1') != '0'
+_background_lock = threading.Lock()
+_background_started = False
+_background_owner = None # Open lock file, kept for the life of the process
 
-    def __next__(self):
-        if not hasattr(self, '_buffer'):
-            self._buffer = []
-        
-        while not self._buffer:
-            new_results = self._fetch_more()
-            if not new_results:
-                raise StopIteration
-            self._buffer.extend(new_results)
-        
-        return self._buffer.pop(0)
 
-    def _fetch_more(self):
-        raise NotImplementedError
+def _claim_background_lock():
+    """Open lock file if this process got the host-wide lock, else None."""
+    f = open(BACKGROUND_LOCK_PATH, 'a+')
+    try:
+        try:
+            import fcntl
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except ImportError:
+            import msvcrt # Windows
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        f.close()
+        return None
+    return f
 
-class BingImageSearch(SearchEngine):
-    def __init__(self, query):
-        super().__init__(query)
-        self.offset = 1 # Bing starts at 1
 
-    def _fetch_more(self):
-        if self.offset > 1000: return []
-        
-        url = "https://www.bing.com/images/search"
-        params = {
-            'q': self.query,
-            'form': 'HDRSC2',
-            'first': self.offset,
-            'scenario': 'ImageBasicHover'
-        }
-        
-        try:
-            print(f"Fetching Bing offset {self.offset}...")
-            resp = requests.get(url, params=params, headers=self.headers, timeout=10)
-            
-            links = re.findall(r'murl&quot;:&quot;([^&]+)&quot;', resp.text)
-            if not links:
-                 links = re.findall(r'"murl":"([^"]+)"', resp.text)
-            
-            formatted_results = []
-            for link in links:
-                formatted_results.append({
-                    'image': link,
-                    'thumbnail': link,
-                    'title': 'Bing Image',
-                    'source': 'Bing',
-                    'url': link
-                })
-            
-            if not formatted_results: return []
-            self.offset += len(formatted_results)
-            return formatted_results
-        except Exception as e:
-            print(f"Bing search error: {e}")
-            return []
+def start_background_workers():
+    """
+    Start the watch-list poller and the tag-list sync, in one process only.
+    Every worker calls this on its first request (so it also runs under a
+    WSGI server); the lock file makes sure only one of them polls, or each
+    would spend its own share of the Rule34 budget.
+    """
+    global _background_started, _background_owner
+    with _background_lock:
+        if _background_started:
+            return
+        _background_started = True
+        if not BACKGROUND_WORKERS:
+            return
+        _background_owner = _claim_background_lock()
+    if _background_owner is None:
+        print("[App] Another process runs the watch-list and tag sync")
+        return
+    # Resume polling saved queries
+    WATCHLIST.start()
+    # Slowly pull the Rule34 tag list for autocomplete and tag validation
+    TAG_INDEX.start_sync()
 
-class DuckDuckGoSearch(SearchEngine):
-    def __init__(self, query):
-        super().__init__(query)
-        self.headers['Referer'] = 'https://duckduckgo.com/'
 
-    def _fetch_more(self):
-        if self.offset > 0: return []
-        
-        # 1. Get VQD
-        try:
-            print("Fetching DDG VQD...")
-            res = requests.get('https://duckduckgo.com/', params={'q': self.query}, headers=self.headers)
-            
-            vqd = None
-            # Regex for vqd
-            m = re.search(r'vqd=[\'"]([^\'"]+)[\'"]', res.text)
-            if m:
-                vqd = m.group(1)
-            
-            if not vqd:
-                # Try simpler search if regex fails or blocked
-                print("DDG VQD not found.")
-                return []
-            
-            # 2. Fetch Images
-            url = "https://duckduckgo.com/i.js"
-            params = {
-                'l': 'us-en',
-                'o': 'json',
-                'q': self.query,
-                'vqd': vqd,
-                'f': ',,,',
-                'p': '1'
-            }
-            # Referer is crucial
-            self.headers['Referer'] = 'https://duckduckgo.com/'
-            res = requests.get(url, params=params, headers=self.headers)
-            
-            if res.status_code == 403:
-                print("DDG 403 Forbidden - Bot detected.")
-                return []
-                
-            data = res.json()
-            results = data.get('results', [])
-            
-            formatted = []
-            for r in results:
-                formatted.append({
-                    'image': r.get('image'),
-                    'thumbnail': r.get('thumbnail'),
-                    'title': r.get('title', 'DDG Image'),
-                    'source': 'DuckDuckGo',
-                    'url': r.get('url')
-                })
-            
-            self.offset = 1
-            return formatted
-        except Exception as e:
-            print(f"DDG Error: {e}")
-            return []
-
-class Rule34Search(SearchEngine):
-    def __init__(self, query):
-        super().__init__(query)
-        self.page = 0
-
-    def _fetch_more(self):
-        # Use standard Rule34.xxx API (dapi)
-        # Note: 'rule34.xyz' might be a different site. 
-        # API Url: https://api.rule34.xxx/index.php?page=dapi&s=post&q=index&json=1
-        # The 'api.' subdomain sometimes complicates things. The main domain works too?
-        # Let's try main domain: https://rule34.xxx/index.php
-        
-        url = "https://rule34.xxx/index.php" 
-        params = {
-            'page': 'dapi',
-            's': 'post',
-            'q': 'index',
-            'json': 1,
-            'limit': 20,
-            'pid': self.page,
-            'tags': self.query
-        }
-        
-        try:
-            print(f"Fetching Rule34 page {self.page}...")
-            # Some boorus require User-Agent to not look like script, but we have one.
-            # Sometimes 'api.' is strict.
-            res = requests.get(url, params=params, headers=self.headers, timeout=10)
-            
-            if res.status_code != 200:
-                print(f"Rule34 status: {res.status_code}")
-                # Fallback to HTML scraping if API blocks
-                return []
-            
-            # Check if response is empty string (sometimes happens if no results)
-            if not res.text.strip():
-                return []
-                
-            try:
-                data = res.json()
-            except json.JSONDecodeError:
-                print("Rule34 returned non-JSON")
-                return []
-            
-            formatted = []
-            # data is a list of dicts
-            if isinstance(data, list):
-                for item in data:
-                    if isinstance(item, dict):
-                         formatted.append({
-                            'image': item.get('file_url'),
-                            'thumbnail': item.get('preview_url'),
-                            'title': f"Score: {item.get('score', 0)}",
-                            'source': 'Rule34',
-                            'url': f"https://rule34.xxx/index.php?page=post&s=view&id={item.get('id')}"
-                        })
-            
-            if not formatted: return []
-            self.page += 1
-            return formatted
-            
-        except Exception as e:
-            print(f"Rule34 Error: {e}")
-            return []
-
-class YandexSearch(SearchEngine):
-    def __init__(self, query):
-        super().__init__(query)
-        self.page = 0
-
-    def _fetch_more(self):
-        # Yandex has difficult scraping protections (CAPTCHA).
-        # We can try a very basic scrape of the initial page.
-        if self.page > 0: return []
-        
-        url = f"https://yandex.com/images/search"
-        params = {'text': self.query}
-        
-        try:
-             # This is highly likely to get blocked without cookies/selenium
-             # But we'll try best effort with a standard header.
-             res = requests.get(url, params=params, headers=self.headers, timeout=10)
-             
-             # Look for JSON data often embedded in data-bem or similar attributes
-             # Detailed scraping is complex in one go.
-             # Fallback: Regex for commonly exposed image URLs (tse...)
-             
-             # Matches simplified for yandex
-             # This is a weak implementation but "top 3" requirement is hard without APIs.
-             matches = re.findall(r'"hh?tps?://[^"]+"', res.text)
-             # Filter for image extensions
-             images = [m.strip('"') for m in matches if any(x in m for x in ['.jpg', '.png', '.jpeg']) and 'avatars.mds.yandex.net' not in m]
-             # Uniq
-             images = list(set(images))
-             
-             formatted = []
-             for img in images[:30]:
-                  formatted.append({
-                      'image': img,
-                      'thumbnail': img,
-                      'title': 'Yandex Result',
-                      'source': 'Yandex',
-                      'url': img
-                  })
-                  
-             self.page = 1
-             return formatted
-        except Exception as e:
-            print(f"Yandex Error: {e}")
-            return []
+@app.before_request
+def ensure_background_workers():
+    if not _background_started:
+        start_background_workers()
+
+
+@app.after_request
+def compress_json(response):
+    """Strong ETag / 304 on search pages, then gzip or deflate per Accept-Encoding."""
+    if (response.status_code != 200 or response.direct_passthrough
+            or response.mimetype != 'application/json'):
+        return response
+    body = response.get_data()
+    encoding = api_common.choose_encoding(body, request.accept_encodings)
+    if api_common.wants_etag(request.endpoint, request.args):
+        etag = api_common.body_etag(body, encoding)
+        if api_common.is_not_modified(etag, request.if_none_match):
+            not_modified = Response(status=304)
+            not_modified.set_etag(etag)
+            not_modified.vary.add('Accept-Encoding')
+            return not_modified
+        response.set_etag(etag)
+
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.set_data(api_common.compress(body, encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+def encode_results(results):
+    return api_common.encode_results(results, request.args.get('format'), request.args.get('fields'))
+
 def get_next_batch(gen, count=30):
     results = []
     try:
         for _ in range(count):
-            r = next(gen)
-            results.append({
-                'image': r.get('image'),
-                'thumbnail': r.get('thumbnail'),
-                'title': r.get('title'),
-                'source': r.get('source'),
-                'url': r.get('url'),
-                'width': r.get('width', 0),
-                'height': r.get('height', 0)
-            })
+            results.append(next(gen))
     except StopIteration:
         pass
     except Exception as e:
         print(f"Error iterating: {e}")
     return results
 
+def get_cursor_page(gen):
+    return api_common.cursor_page(gen, gen.fetch_next_batch(), request.args.get('format'), request.args.get('fields'))
+
 @app.route('/api/search', methods=['GET'])
 def search_images():
     query = request.args.get('q', '')
     size = request.args.get('size', '')
     engine = request.args.get('engine', 'bing')
+    # 'session' keeps the engine in SEARCH_SESSIONS, 'cursor' keeps it in the client
+    paging = request.args.get('paging', 'session')
     
     if not query:
         return jsonify({'error': 'No query provided'}), 400
+    if engine == 'rule34':
+        error = unknown_tags_error(query)
+        if error:
+            return error
+
+    # Race a backup engine when the primary is slow (off by default)
+    hedge = request.args.get('hedge', '0') == '1'
+    # Fill in width/height for every result (always on for 2k/4k/8k/Wallpaper)
+    probe = request.args.get('probe', '0') == '1'
+    # Serve best-first over a sliding window of this many pages (0 = upstream order)
+    rank = max(0, request.args.get('rank', 0, type=int))
 
     try:
-        # Handle custom high-res triggers
-        search_query = query
-        if size in ['2k', '4k', '8k']:
-            search_query = f"{query} {size} wallpaper"
-            
-        # Select Generator
-        if engine == 'ddg':
-            gen = DuckDuckGoSearch(search_query)
-        elif engine == 'rule34':
-            gen = Rule34Search(search_query) # Uses tags usually
-        elif engine == 'yandex':
-            gen = YandexSearch(search_query)
-        else:
-            gen = BingImageSearch(search_query)
+        # Size terms are appended by the engine itself
+        gen = get_engine(engine, query, size=size or None, hedge=hedge, probe=probe, rank=rank, new_search=True, paging=paging)
+        
+        if paging == 'cursor':
+            results, cursor = get_cursor_page(gen)
+            return jsonify({'results': results, 'cursor': cursor})
         
         # Create session
         session_id = str(uuid.uuid4())
         SEARCH_SESSIONS[session_id] = gen
         
         # Get first batch
-        results = get_next_batch(gen, count=30)
+        results = encode_results(get_next_batch(gen, count=30))
             
     except Exception as e:
         print(f"Search error: {e}")
@@ -321,77 +174,148 @@ def search_images():
 
 @app.route('/api/more', methods=['GET'])
 def search_more():
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            gen = engine_from_state(cursors.decode(cursor))
+            results, cursor = get_cursor_page(gen)
+        except cursors.InvalidCursor as e:
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+        return jsonify({'results': results, 'cursor': cursor})
+
     session_id = request.args.get('session_id')
     if not session_id or session_id not in SEARCH_SESSIONS:
         return jsonify({'error': 'Invalid or expired session'}), 400
         
     try:
         gen = SEARCH_SESSIONS[session_id]
-        results = get_next_batch(gen, count=30)
+        results = encode_results(get_next_batch(gen, count=30))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
         
     return jsonify({'results': results})
 
+@app.route('/api/local_search', methods=['GET'])
+def local_search():
+    """Answer from previously seen results only; never calls upstream."""
+    query = request.args.get('q', '')
+    if not query:
+        return jsonify({'error': 'No query provided'}), 400
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    offset = request.args.get('offset', 0, type=int)
+    
+    start = time.perf_counter()
+    rows = LOCAL_INDEX.search(query, limit=limit, offset=offset, source=request.args.get('source'))
+    took_ms = (time.perf_counter() - start) * 1000
+    
+    return jsonify({'results': encode_results(rows), 'took_ms': round(took_ms, 3)})
+
+def unknown_tags_error(query):
+    """400 response naming tags the tag index knows don't exist, else None."""
+    payload = api_common.unknown_tags(query)
+    return (jsonify(payload), 400) if payload else None
+
+@app.route('/api/tags', methods=['GET'])
+def tag_autocomplete():
+    """Rule34 tag completions from the local tag index; never calls upstream."""
+    limit = min(request.args.get('limit', 10, type=int), 50)
+    return jsonify(api_common.tag_completions(request.args.get('prefix', ''), limit))
+
+@app.route('/api/tags/sync', methods=['GET', 'POST'])
+def tag_sync():
+    # POST starts the background tag-list sync (no-op if running, or if
+    # another process owns it)
+    if request.method == 'POST':
+        start_background_workers()
+    return jsonify(TAG_INDEX.stats())
+
+@app.route('/api/history', methods=['GET'])
+def search_history():
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    return jsonify({'history': LOCAL_INDEX.history(limit)})
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/transfers', methods=['GET'])
+def transfers():
+    """Transfer scheduler state: active and queued transfers per priority."""
+    return jsonify(SCHEDULER.snapshot())
+
+def transfer_owner(session_id=None):
+    return api_common.transfer_owner(request.remote_addr, session_id, request.args.get('session_id'))
+
 @app.route('/api/proxy_download', methods=['GET'])
 def proxy_download():
     url = request.args.get('url')
     if not url:
         return "No URL provided", 400
+    # Grids loading thumbnails through the proxy pass priority=thumbnail
+    priority = 'thumbnail' if request.args.get('priority') == 'thumbnail' else 'interactive'
+    try:
+        transfer = SCHEDULER.acquire(priority, transfer_owner(), url, timeout=api_common.PROXY_QUEUE_TIMEOUT)
+    except QueueTimeout as e:
+        return str(e), 503
     try:
         # Stream the file from the source to the client
         r = requests.get(url, stream=True, timeout=15)
         r.raise_for_status()
-        
-        # Extract filename
-        filename = url.split('/')[-1].split('?')[0]
-        if not filename or len(filename) > 50: 
-            filename = f"image_{uuid.uuid4().hex[:8]}.jpg"
-        
-        # Ensure it has an extension
-        if '.' not in filename: filename += ".jpg"
+        filename = api_common.proxy_filename(url)
             
-        return Response(
-            r.iter_content(chunk_size=8192),
+        response = Response(
+            transfer.stream(counted(r.iter_content(chunk_size=8192), 'proxy')),
             content_type=r.headers.get('Content-Type', 'image/jpeg'),
             headers={'Content-Disposition': f'attachment; filename="{filename}"'}
         )
+        # Also frees the slot if the body is never iterated
+        response.call_on_close(transfer.release)
+        return response
     except Exception as e:
+        transfer.release()
         return str(e), 500
 
-def download_single_image(url):
+def download_watch_items(tags, items):
+    """Watch-list hook: save new posts in the background like /api/download."""
+    urls = [i.image for i in items if i.image]
+    for url in urls:
+        WATCH_DOWNLOADER.submit(download_single_image, url, 'watchlist')
+
+# Shared so auto-downloads from many queries stay at 5 concurrent transfers
+WATCH_DOWNLOADER = ThreadPoolExecutor(max_workers=5, thread_name_prefix='watch-dl')
+WATCHLIST.on_new_items = download_watch_items
+
+@app.route('/api/watchlist', methods=['GET'])
+def watchlist_list():
+    tags = request.args.get('tags')
+    if tags:
+        # New posts found for one query since the server started
+        return jsonify({'tags': tags, 'results': encode_results(WATCHLIST.recent_items(tags))})
+    return jsonify({'queries': WATCHLIST.list()})
+
+@app.route('/api/watchlist', methods=['POST'])
+def watchlist_add():
+    data = request.get_json(silent=True) or {}
+    tags = (data.get('tags') or '').strip()
+    if not tags:
+        return jsonify({'error': 'No tags provided'}), 400
+    error = unknown_tags_error(tags)
+    if error:
+        return error
     try:
-        # Get filename from URL or default
-        filename = url.split('/')[-1].split('?')[0]
-        if not filename or len(filename) > 200:
-            filename = f"image_{abs(hash(url))}.jpg"
-            
-        # Ensure extension
-        if '.' not in filename:
-             filename += ".jpg"
-             
-        # Sanitize filename
-        filename = "".join([c for c in filename if c.isalpha() or c.isdigit() or c in '._- ']).strip()
-        
-        save_path = os.path.join(DOWNLOAD_FOLDER, filename)
-        
-        # Avoid overwrites
-        counter = 1
-        base_name, ext = os.path.splitext(filename)
-        while os.path.exists(save_path):
-            save_path = os.path.join(DOWNLOAD_FOLDER, f"{base_name}_{counter}{ext}")
-            counter += 1
-
-        response = requests.get(url, timeout=15, stream=True)
-        response.raise_for_status()
-        
-        with open(save_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-                
-        return {'url': url, 'status': 'success', 'path': save_path}
-    except Exception as e:
-        return {'url': url, 'status': 'error', 'error': str(e)}
+        entry = WATCHLIST.add(tags, interval=data.get('interval'), auto_download=data.get('auto_download', False))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(entry)
+
+@app.route('/api/watchlist', methods=['DELETE'])
+def watchlist_remove():
+    tags = request.args.get('tags', '')
+    if not WATCHLIST.remove(tags):
+        return jsonify({'error': 'Not in watch-list'}), 404
+    return jsonify({'removed': tags})
 
 @app.route('/api/download', methods=['POST'])
 def download_images():
@@ -404,10 +328,37 @@ def download_images():
     results = []
     # Use ThreadPoolExecutor for concurrent downloads
     with ThreadPoolExecutor(max_workers=5) as executor:
-        results = list(executor.map(download_single_image, urls))
+        owner = transfer_owner(data.get('session_id'))
+        results = list(executor.map(lambda url: download_single_image(url, owner), urls))
         
     return jsonify({'results': results})
 
+@app.route('/api/export.zip', methods=['GET', 'POST'])
+def export_zip():
+    # POST {"urls": [...]} from scripts, or GET ?url=...&url=... from a plain link
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        urls = data.get('urls') or request.form.getlist('urls')
+    else:
+        urls = request.args.getlist('url')
+    
+    if not urls:
+        return jsonify({'error': 'No URLs provided'}), 400
+    if len(urls) > MAX_EXPORT_URLS:
+        return jsonify({'error': f'Too many URLs (max {MAX_EXPORT_URLS})'}), 400
+        
+    filename = f"images_{time.strftime('%Y%m%d_%H%M%S')}.zip"
+    return Response(
+        stream_zip(urls, owner=transfer_owner()),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
 if __name__ == '__main__':
+    debug = True
+    # Don't wait for the first request. The debug reloader runs this block in
+    # its watcher process too, which must not take the lock from the server
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_workers()
     # Listen on all interfaces
-    app.run(host='0.0.0.0', debug=True, port=5000)
+    app.run(host='0.0.0.0', debug=debug, port=5000)
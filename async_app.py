@@ -0,0 +1,230 @@
+"""
+asyncio-served variant of the search API (aiohttp).
+
+Serves the hot paths of app.py with the same payloads: /api/search,
+/api/more, /api/tags, /api/transfers, /api/proxy_download, /api/download
+and /metrics. Engines run through fetch_next_batch_async() and downloads
+through aiohttp, so one process can hold thousands of slow upstream calls
+open instead of one thread each. Local search, history, the watch-list,
+zip export and tag sync stay on the Flask app. Needs aiohttp (see
+requirements.txt).
+
+    python async_app.py    # port 5001, next to the Flask app on 5000
+"""
+import uuid
+import asyncio
+import aiohttp
+from aiohttp import web
+from werkzeug.http import parse_accept_header, parse_etags, quote_etag
+from search_logic import get_engine, engine_from_state
+from downloader import download_image_async
+from bandwidth import SCHEDULER, QueueTimeout
+import api_common
+import aio_http
+import metrics
+import cursors
+
+# Page parsing must not block the event loop either
+api_common.configure_parse_pool()
+
+# Search sessions of this process (separate from the Flask app's)
+SEARCH_SESSIONS = {}
+
+routes = web.RouteTableDef()
+
+
+@web.middleware
+async def compress_json(request, handler):
+    """Strong ETag / 304 on search pages, then gzip or deflate per Accept-Encoding."""
+    response = await handler(request)
+    if response.status != 200 or response.content_type != 'application/json' or not isinstance(response.body, bytes):
+        return response
+    body = response.body
+    encoding = api_common.choose_encoding(body, parse_accept_header(request.headers.get('Accept-Encoding')))
+    if api_common.wants_etag(request.match_info.route.name, request.query):
+        etag = api_common.body_etag(body, encoding)
+        if api_common.is_not_modified(etag, parse_etags(request.headers.get('If-None-Match'))):
+            return web.Response(status=304, headers={'ETag': quote_etag(etag), 'Vary': 'Accept-Encoding'})
+        response.headers['ETag'] = quote_etag(etag)
+
+    response.headers['Vary'] = 'Accept-Encoding'
+    if encoding:
+        response.body = api_common.compress(body, encoding)
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def encode_results(request, results):
+    return api_common.encode_results(results, request.query.get('format'), request.query.get('fields'))
+
+
+async def get_next_batch(gen, count=30):
+    results = []
+    try:
+        async for result in gen:
+            results.append(result)
+            if len(results) >= count:
+                break
+    except Exception as e:
+        print(f"Error iterating: {e}")
+    return results
+
+
+async def get_cursor_page(request, gen):
+    return api_common.cursor_page(gen, await gen.fetch_next_batch_async(), request.query.get('format'), request.query.get('fields'))
+
+
+@routes.get('/api/search', name='search_images')
+async def search_images(request):
+    query = request.query.get('q', '')
+    size = request.query.get('size', '')
+    engine = request.query.get('engine', 'bing')
+    paging = request.query.get('paging', 'session')
+
+    if not query:
+        return web.json_response({'error': 'No query provided'}, status=400)
+    if engine == 'rule34':
+        error = await api_common.unknown_tags_async(query)
+        if error:
+            return web.json_response(error, status=400)
+
+    hedge = request.query.get('hedge', '0') == '1'
+    probe = request.query.get('probe', '0') == '1'
+    try:
+        rank = max(0, int(request.query.get('rank', 0)))
+    except ValueError:
+        rank = 0
+
+    try:
+        gen = get_engine(engine, query, size=size or None, hedge=hedge, probe=probe, rank=rank, new_search=True, paging=paging)
+
+        if paging == 'cursor':
+            results, cursor = await get_cursor_page(request, gen)
+            return web.json_response({'results': results, 'cursor': cursor})
+
+        session_id = str(uuid.uuid4())
+        SEARCH_SESSIONS[session_id] = gen
+        results = encode_results(request, await get_next_batch(gen, count=30))
+    except Exception as e:
+        print(f"Search error: {e}")
+        return web.json_response({'error': str(e)}, status=500)
+
+    return web.json_response({'results': results, 'session_id': session_id})
+
+
+@routes.get('/api/more', name='search_more')
+async def search_more(request):
+    cursor = request.query.get('cursor')
+    if cursor:
+        try:
+            gen = engine_from_state(cursors.decode(cursor))
+            results, cursor = await get_cursor_page(request, gen)
+        except cursors.InvalidCursor as e:
+            return web.json_response({'error': str(e)}, status=400)
+        except Exception as e:
+            return web.json_response({'error': str(e)}, status=500)
+        return web.json_response({'results': results, 'cursor': cursor})
+
+    session_id = request.query.get('session_id')
+    if not session_id or session_id not in SEARCH_SESSIONS:
+        return web.json_response({'error': 'Invalid or expired session'}, status=400)
+
+    try:
+        results = encode_results(request, await get_next_batch(SEARCH_SESSIONS[session_id], count=30))
+    except Exception as e:
+        return web.json_response({'error': str(e)}, status=500)
+
+    return web.json_response({'results': results})
+
+
+@routes.get('/api/tags')
+async def tag_autocomplete(request):
+    try:
+        limit = min(int(request.query.get('limit', 10)), 50)
+    except ValueError:
+        limit = 10
+    return web.json_response(api_common.tag_completions(request.query.get('prefix', ''), limit))
+
+
+@routes.get('/metrics')
+async def metrics_endpoint(request):
+    return web.Response(body=metrics.render().encode(), headers={'Content-Type': 'text/plain; version=0.0.4'})
+
+
+@routes.get('/api/transfers')
+async def transfers(request):
+    return web.json_response(SCHEDULER.snapshot())
+
+
+def transfer_owner(request, session_id=None):
+    return api_common.transfer_owner(request.remote, session_id, request.query.get('session_id'))
+
+
+@routes.get('/api/proxy_download')
+async def proxy_download(request):
+    url = request.query.get('url')
+    if not url:
+        return web.Response(text="No URL provided", status=400)
+    priority = 'thumbnail' if request.query.get('priority') == 'thumbnail' else 'interactive'
+    try:
+        transfer = await SCHEDULER.acquire_async(priority, transfer_owner(request), url, timeout=api_common.PROXY_QUEUE_TIMEOUT)
+    except QueueTimeout as e:
+        return web.Response(text=str(e), status=503)
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=15, sock_read=15)
+    try:
+        upstream = await aio_http.session().get(url, timeout=timeout)
+        upstream.raise_for_status()
+    except Exception as e:
+        transfer.release()
+        return web.Response(text=str(e), status=500)
+
+    filename = api_common.proxy_filename(url)
+
+    response = web.StreamResponse(headers={
+        'Content-Type': upstream.headers.get('Content-Type', 'image/jpeg'),
+        'Content-Disposition': f'attachment; filename="{filename}"',
+    })
+    metrics.DOWNLOADS_IN_FLIGHT.inc('proxy')
+    try:
+        await response.prepare(request)
+        async for chunk in transfer.throttle_async(upstream.content.iter_chunked(8192)):
+            metrics.DOWNLOAD_BYTES.inc('proxy', amount=len(chunk))
+            await response.write(chunk)
+        await response.write_eof()
+    finally:
+        metrics.DOWNLOADS_IN_FLIGHT.dec('proxy')
+        upstream.release()
+        transfer.release()
+    return response
+
+
+@routes.post('/api/download')
+async def download_images(request):
+    try:
+        data = await request.json()
+    except Exception:
+        data = {}
+    urls = data.get('urls', [])
+
+    if not urls:
+        return web.json_response({'error': 'No URLs provided'}, status=400)
+
+    # All queued at once; the scheduler decides how many run
+    owner = transfer_owner(request, data.get('session_id'))
+    results = await asyncio.gather(*(download_image_async(url, owner) for url in urls))
+    return web.json_response({'results': results})
+
+
+async def _close_http(app):
+    await aio_http.close()
+
+
+def create_app():
+    app = web.Application(middlewares=[compress_json])
+    app.add_routes(routes)
+    app.on_cleanup.append(_close_http)
+    return app
+
+
+if __name__ == '__main__':
+    web.run_app(create_app(), host='0.0.0.0', port=5001)
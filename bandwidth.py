@@ -0,0 +1,264 @@
+"""
+Process-wide scheduler for outbound image transfers.
+
+Every proxy, thumbnail, bulk, watch-list and ZIP transfer asks SCHEDULER for
+a slot before connecting upstream, then passes its chunks through the slot
+to be paced:
+
+  * Admission: at most max_transfers at once and per_host per upstream host.
+    Waiters are served by priority (interactive > thumbnail > bulk), and
+    round-robin between owners (session or client) within a priority, so
+    one 200-image download can't queue ahead of everyone else. Bulk may
+    only use bulk_share of the slots, overall and per host, keeping room
+    for interactive ones.
+  * Bandwidth: an optional total bytes/sec ceiling. Priorities with active
+    transfers split it by weight, and an idle priority's share goes to the
+    others.
+
+snapshot() returns the queue state (served at /api/transfers and /metrics).
+"""
+import os
+import time
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from urllib.parse import urlsplit
+from metrics import TRANSFERS_ACTIVE, TRANSFERS_QUEUED, TRANSFER_WAIT
+
+PRIORITIES = ('interactive', 'thumbnail', 'bulk')
+WEIGHTS = {'interactive': 6, 'thumbnail': 3, 'bulk': 1}
+
+
+class QueueTimeout(Exception):
+    pass
+
+
+class Transfer:
+    """An admitted transfer; release() (or leaving the with block) frees the slot."""
+    def __init__(self, scheduler, priority, owner, host):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.owner = owner
+        self.host = host
+        self.granted = False
+        self.released = False
+        self.event = threading.Event()
+        self.future = None # Set for async waiters
+        self.queued_at = time.monotonic()
+
+    def _grant(self):
+        self.granted = True
+        if self.future is not None:
+            self.future.get_loop().call_soon_threadsafe(self._resolve)
+        else:
+            self.event.set()
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+    def release(self):
+        self.scheduler._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def throttle(self, chunks):
+        """Pass chunks through at this transfer's share of the ceiling."""
+        for chunk in chunks:
+            delay = self.scheduler._reserve(self.priority, len(chunk))
+            if delay > 0:
+                time.sleep(delay)
+            yield chunk
+
+    def stream(self, chunks):
+        """throttle(), releasing the slot when the stream ends or is closed."""
+        try:
+            yield from self.throttle(chunks)
+        finally:
+            self.release()
+
+    async def throttle_async(self, chunks):
+        async for chunk in chunks:
+            delay = self.scheduler._reserve(self.priority, len(chunk))
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield chunk
+
+
+class BandwidthScheduler:
+    def __init__(self, max_bytes_per_sec=0, max_transfers=16, per_host=4, bulk_share=0.75):
+        self.max_bytes_per_sec = max_bytes_per_sec # 0 = no ceiling
+        self.max_transfers = max_transfers
+        self.per_host = per_host
+        self.bulk_share = bulk_share
+        self.lock = threading.Lock()
+        self.queues = {p: OrderedDict() for p in PRIORITIES} # owner -> deque of waiting Transfers
+        self.active = {p: 0 for p in PRIORITIES}
+        self.hosts = {}
+        self.bulk_hosts = {} # Bulk share of self.hosts
+        self.clocks = {p: 0.0 for p in PRIORITIES} # Next free send time per priority
+
+    def _class_limit(self, priority):
+        if priority == 'bulk':
+            return max(1, int(self.max_transfers * self.bulk_share))
+        return self.max_transfers
+
+    def _host_free(self, transfer):
+        """True if transfer's host has a connection free for its priority."""
+        if self.hosts.get(transfer.host, 0) >= self.per_host:
+            return False
+        if transfer.priority == 'bulk':
+            # Otherwise a bulk job can hold every connection to a host and
+            # interactive requests for it time out behind the downloads
+            return self.bulk_hosts.get(transfer.host, 0) < max(1, int(self.per_host * self.bulk_share))
+        return True
+
+    # --- Admission ---
+
+    def _enqueue(self, transfer):
+        if transfer.priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority {transfer.priority!r}")
+        with self.lock:
+            owners = self.queues[transfer.priority]
+            owners.setdefault(transfer.owner, deque()).append(transfer)
+            self._dispatch()
+            self._update_gauges()
+
+    def _dispatch(self):
+        """Start queued transfers while there is room (lock held)."""
+        for priority in PRIORITIES:
+            owners = self.queues[priority]
+            progressed = True
+            while owners and progressed:
+                progressed = False
+                for owner in list(owners):
+                    if sum(self.active.values()) >= self.max_transfers:
+                        return
+                    if self.active[priority] >= self._class_limit(priority):
+                        break
+                    waiting = owners[owner]
+                    # Oldest waiter of this owner whose host has a free connection
+                    transfer = next((t for t in waiting if self._host_free(t)), None)
+                    if transfer is None:
+                        continue
+                    waiting.remove(transfer)
+                    if waiting:
+                        owners.move_to_end(owner) # Round-robin between owners
+                    else:
+                        del owners[owner]
+                    self.active[priority] += 1
+                    self.hosts[transfer.host] = self.hosts.get(transfer.host, 0) + 1
+                    if priority == 'bulk':
+                        self.bulk_hosts[transfer.host] = self.bulk_hosts.get(transfer.host, 0) + 1
+                    TRANSFER_WAIT.observe(time.monotonic() - transfer.queued_at, priority)
+                    transfer._grant()
+                    progressed = True
+
+    def _cancel(self, transfer):
+        with self.lock:
+            if transfer.granted:
+                return False
+            waiting = self.queues[transfer.priority].get(transfer.owner)
+            if waiting and transfer in waiting:
+                waiting.remove(transfer)
+                if not waiting:
+                    del self.queues[transfer.priority][transfer.owner]
+            transfer.released = True
+            self._update_gauges()
+            return True
+
+    def _release(self, transfer):
+        with self.lock:
+            if transfer.released or not transfer.granted:
+                return
+            transfer.released = True
+            self.active[transfer.priority] -= 1
+            self.hosts[transfer.host] -= 1
+            if not self.hosts[transfer.host]:
+                del self.hosts[transfer.host]
+            if transfer.priority == 'bulk':
+                self.bulk_hosts[transfer.host] -= 1
+                if not self.bulk_hosts[transfer.host]:
+                    del self.bulk_hosts[transfer.host]
+            self._dispatch()
+            self._update_gauges()
+
+    def acquire(self, priority, owner, url, timeout=None, cancel=None):
+        """
+        Block until a transfer slot for url is free. Raises QueueTimeout after
+        `timeout` seconds, or once the `cancel` event is set.
+        """
+        transfer = Transfer(self, priority, owner, urlsplit(url).netloc)
+        self._enqueue(transfer)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not transfer.event.is_set():
+            wait = 0.5
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+            if transfer.event.wait(max(wait, 0)):
+                break
+            if (cancel is not None and cancel.is_set()) or (deadline is not None and time.monotonic() >= deadline):
+                if self._cancel(transfer):
+                    raise QueueTimeout(f"No {priority} transfer slot for {transfer.host}")
+                break # Granted just now
+        return transfer
+
+    async def acquire_async(self, priority, owner, url, timeout=None):
+        transfer = Transfer(self, priority, owner, urlsplit(url).netloc)
+        transfer.future = asyncio.get_running_loop().create_future()
+        self._enqueue(transfer)
+        try:
+            await asyncio.wait_for(asyncio.shield(transfer.future), timeout)
+        except asyncio.TimeoutError:
+            if self._cancel(transfer):
+                raise QueueTimeout(f"No {priority} transfer slot for {transfer.host}")
+        except asyncio.CancelledError:
+            if not self._cancel(transfer):
+                transfer.release() # Granted meanwhile; nobody will use it
+            raise
+        return transfer
+
+    # --- Bandwidth ---
+
+    def _reserve(self, priority, nbytes):
+        """Seconds to wait before sending nbytes more at this priority."""
+        if not self.max_bytes_per_sec:
+            return 0.0
+        with self.lock:
+            busy = [p for p in PRIORITIES if self.active[p]]
+            if priority not in busy:
+                busy.append(priority)
+            rate = self.max_bytes_per_sec * WEIGHTS[priority] / sum(WEIGHTS[p] for p in busy)
+            now = time.monotonic()
+            start = max(now, self.clocks[priority])
+            self.clocks[priority] = start + nbytes / rate
+            return start - now
+
+    # --- Monitoring ---
+
+    def _update_gauges(self):
+        for p in PRIORITIES:
+            TRANSFERS_ACTIVE.set(self.active[p], p)
+            TRANSFERS_QUEUED.set(sum(len(q) for q in self.queues[p].values()), p)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'max_bytes_per_sec': self.max_bytes_per_sec,
+                'max_transfers': self.max_transfers,
+                'per_host': self.per_host,
+                'active': dict(self.active),
+                'queued': {p: {str(owner): len(q) for owner, q in self.queues[p].items()} for p in PRIORITIES},
+                'hosts': dict(self.hosts),
+            }
+
+
+SCHEDULER = BandwidthScheduler(
+    max_bytes_per_sec=int(os.environ.get('Q8_MAX_BYTES_PER_SEC', 0)),
+    max_transfers=int(os.environ.get('Q8_MAX_TRANSFERS', 16)),
+    per_host=int(os.environ.get('Q8_MAX_PER_HOST', 4)),
+)
@@ -0,0 +1,440 @@
+"""
+Offline benchmark suite.
+
+Runs local stub HTTP servers that replay the recorded upstream responses in
+bench_fixtures/ (with configurable latency, error rate and 429 rate), points
+the engines at them and measures:
+
+  * each engine's _fetch_more, and concurrent identical fetches coalescing
+  * the Flask endpoints (/api/search, /api/more, /api/download, /api/proxy_download)
+  * the Rule34 rate limiter under concurrent load
+  * request-thread latency while parallel searches parse large pages,
+    parsed inline vs in page_parsers.PARSE_POOL's worker processes
+
+Results (throughput, p50/p95/p99 latency, peak traced memory) are compared
+against bench_baseline.json. Re-record the baseline on your own machine with
+--save-baseline before relying on the comparison.
+
+    python benchmark.py
+    python benchmark.py --latency 0.2 --error-rate 0.05 --rate-429 0.02
+    python benchmark.py --only engine --save-baseline
+    python benchmark.py --only parse --page-scale 16
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import struct
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import tracemalloc
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import search_logic
+from api_client import CLIENT
+from local_index import LOCAL_INDEX
+from page_parsers import PARSE_POOL
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_DIR = os.path.join(HERE, 'bench_fixtures')
+BASELINE_FILE = os.path.join(HERE, 'bench_baseline.json')
+
+# The app must not start the watch-list or tag sync against the stubs: a
+# tag sync of the stub would reject every Rule34 query
+os.environ.setdefault('Q8_BACKGROUND_WORKERS', '0')
+
+
+# ---------------------------------------------------------------------------
+# Stub upstream servers
+# ---------------------------------------------------------------------------
+
+def make_png(width, height):
+    """Solid-colour PNG of the given size (compresses to a few KB)."""
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+    raw = (b'\x00' + b'\x80' * (width * 3)) * height
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw, 9))
+            + chunk(b'IEND', b''))
+
+
+class StubServer:
+    """
+    Serves fixed bodies by path. Every response is delayed by `latency`
+    (+/- `jitter`) and fails with 500 / 429 at the configured rates.
+    """
+    def __init__(self, routes, latency=0.0, jitter=0.0, error_rate=0.0, rate_429=0.0, seed=0):
+        self.routes = routes # path -> (content_type, bytes)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_429 = rate_429
+        self.rng = random.Random(seed)
+        self.hits = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.hits += 1
+                delay = stub.latency + stub.rng.uniform(-stub.jitter, stub.jitter)
+                if delay > 0:
+                    time.sleep(delay)
+                roll = stub.rng.random()
+                path = self.path.split('?')[0]
+                if roll < stub.rate_429:
+                    return self._send(429, 'text/plain', b'Too Many Requests')
+                if roll < stub.rate_429 + stub.error_rate:
+                    return self._send(500, 'text/plain', b'Internal Server Error')
+                route = stub.routes.get(path) or stub.routes.get('*')
+                if route is None:
+                    return self._send(404, 'text/plain', b'Not Found')
+                ctype, body = route
+                self._send(200, ctype, body)
+
+            def _send(self, status, ctype, body):
+                self.send_response(status)
+                self.send_header('Content-Type', ctype)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def load_fixture(name, img_base):
+    with open(os.path.join(FIXTURE_DIR, name), 'r', encoding='utf-8') as f:
+        return f.read().replace('{IMG}', img_base).encode('utf-8')
+
+
+def start_stubs(args):
+    """Start one stub per upstream and point the engines at them."""
+    net = dict(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, rate_429=args.rate_429)
+    images = StubServer({'*': ('image/png', make_png(1920, 1080))}, latency=args.latency, jitter=args.jitter)
+    img = images.url
+    stubs = {
+        'images': images,
+        'bing': StubServer({'/images/search': ('text/html', load_fixture('bing.html', img))}, seed=1, **net),
+        'ddg': StubServer({
+            '/': ('text/html', load_fixture('ddg_home.html', img)),
+            '/i.js': ('application/json', load_fixture('ddg_images.json', img)),
+        }, seed=2, **net),
+        'yandex': StubServer({'/images/search': ('text/html', load_fixture('yandex.html', img))}, seed=3, **net),
+        'rule34': StubServer({'/index.php': ('application/json', load_fixture('rule34.json', img))}, seed=4, **net),
+    }
+    search_logic.BING_URL = stubs['bing'].url + '/images/search'
+    search_logic.DDG_URL = stubs['ddg'].url + '/'
+    search_logic.DDG_IMAGES_URL = stubs['ddg'].url + '/i.js'
+    search_logic.YANDEX_URL = stubs['yandex'].url + '/images/search'
+    CLIENT.base_url = stubs['rule34'].url + '/index.php'
+    CLIENT.backoff = 0.05
+    return stubs
+
+
+# ---------------------------------------------------------------------------
+# Measurement
+# ---------------------------------------------------------------------------
+
+def percentile(sorted_data, pct):
+    if not sorted_data:
+        return 0.0
+    return sorted_data[min(len(sorted_data) - 1, int(pct * len(sorted_data)))]
+
+
+def run_load(op, iterations, concurrency):
+    """Call op() `iterations` times from `concurrency` threads."""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    counter = iter(range(iterations))
+
+    def worker():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            start = time.perf_counter()
+            try:
+                ok = op(i)
+            except Exception as e:
+                print(f"[Bench] op error: {e}")
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if ok is False:
+                    errors[0] += 1
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    wall = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        'ops': len(latencies),
+        'errors': errors[0],
+        'throughput': round(len(latencies) / wall, 2) if wall else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+# ---------------------------------------------------------------------------
+# Scenarios
+# ---------------------------------------------------------------------------
+
+def engine_scenarios(args):
+    def make(name):
+        def op(i):
+            # _fetch_more directly: exercises request + parse, no latency bookkeeping.
+            # A query per op so concurrent ops don't share a fetch through FLIGHTS
+            return bool(search_logic.get_engine(name, f'query {i}')._fetch_more())
+        return op
+
+    def coalesced(i):
+        # Every op asks for the same page: concurrent ones join one upstream fetch
+        return bool(search_logic.get_engine('bing', 'query')._fetch_more())
+
+    CLIENT.min_delay = 0 # Engine numbers should not include throttling
+    scenarios = {f"engine.{name}": make(name) for name in ('bing', 'ddg', 'yandex', 'rule34')}
+    scenarios['engine.coalesced'] = coalesced
+    return scenarios
+
+
+def flask_scenarios(args):
+    import app as server
+    import downloader
+    # /api/download saves here; removed with the rest of tmpdir
+    downloader.DOWNLOAD_FOLDER = args.tmpdir
+    client = server.app.test_client()
+    image_url = args.stubs['images'].url + '/img/bench.png'
+    CLIENT.min_delay = 0
+
+    def search(engine):
+        def op(i):
+            res = client.get(f'/api/search?q=query+{i}&engine={engine}')
+            server.SEARCH_SESSIONS.pop(res.get_json().get('session_id'), None)
+            return res.status_code == 200
+        return op
+
+    def more(i):
+        res = client.get(f'/api/search?q=query+{i}&engine=rule34')
+        session_id = res.get_json()['session_id']
+        res = client.get(f'/api/more?session_id={session_id}')
+        server.SEARCH_SESSIONS.pop(session_id, None)
+        return res.status_code == 200
+
+    def download(i):
+        res = client.post('/api/download', json={'urls': [image_url] * 3})
+        return res.status_code == 200 and all(r['status'] == 'success' for r in res.get_json()['results'])
+
+    def proxy(i):
+        res = client.get(f'/api/proxy_download?url={image_url}')
+        size = sum(len(chunk) for chunk in res.response)
+        res.close()
+        return res.status_code == 200 and size > 0
+
+    scenarios = {f"api.search.{e}": search(e) for e in ('bing', 'ddg', 'yandex', 'rule34')}
+    scenarios['api.more'] = more
+    scenarios['api.download'] = download
+    scenarios['api.proxy_download'] = proxy
+    return scenarios
+
+
+def limiter_scenarios(args):
+    def op(i):
+        CLIENT._wait_for_slot()
+        return True
+
+    def setup():
+        CLIENT.min_delay = args.limiter_delay
+        CLIENT.last_request_time = 0
+    op.setup = setup
+    return {'limiter.wait_for_slot': op}
+
+
+def parse_scenarios(args):
+    """
+    Times a cheap Flask request (/metrics) while background threads keep
+    running Bing and Yandex searches against pages scaled up to real size.
+    parse.inline parses in those threads (holding the GIL); parse.pool
+    hands the bodies to PARSE_POOL's worker processes.
+    """
+    import app as server
+    client = server.app.test_client()
+    img = args.stubs['images'].url
+    pages = StubServer({
+        '/bing': ('text/html', load_fixture('bing.html', img) * args.page_scale),
+        '/yandex': ('text/html', load_fixture('yandex.html', img) * args.page_scale),
+    }, latency=args.latency)
+    urls = (search_logic.BING_URL, search_logic.YANDEX_URL)
+    stop = threading.Event()
+    threads = []
+
+    def load():
+        engines = ('bing', 'yandex')
+        i = 0
+        while not stop.is_set():
+            search_logic.get_engine(engines[i % 2], f'load {i}')._fetch_more()
+            i += 1
+
+    def make(workers):
+        def op(i):
+            return client.get('/metrics').status_code == 200
+
+        def setup():
+            search_logic.BING_URL = pages.url + '/bing'
+            search_logic.YANDEX_URL = pages.url + '/yandex'
+            PARSE_POOL.workers = workers
+            if workers:
+                PARSE_POOL.run(len, b'x' * PARSE_POOL.min_size) # Start the workers outside the timing
+            stop.clear()
+            threads[:] = [threading.Thread(target=load, daemon=True) for _ in range(args.parse_load)]
+            for t in threads: t.start()
+
+        def teardown():
+            stop.set()
+            for t in threads: t.join()
+            PARSE_POOL.shutdown()
+            search_logic.BING_URL, search_logic.YANDEX_URL = urls
+
+        op.setup, op.teardown = setup, teardown
+        op.concurrency = 1 # One request at a time: measures stalls, not queueing
+        return op
+
+    return {
+        'parse.inline': make(0),
+        'parse.pool': make(args.parse_workers),
+    }
+
+
+SUITES = {
+    'engine': engine_scenarios,
+    'api': flask_scenarios,
+    'limiter': limiter_scenarios,
+    'parse': parse_scenarios,
+}
+
+
+# ---------------------------------------------------------------------------
+# Baseline comparison
+# ---------------------------------------------------------------------------
+
+def compare(results, baseline, tolerance):
+    """Return a list of regression messages (empty if none)."""
+    regressions = []
+    for name, cur in results.items():
+        if cur['ops'] and cur['errors'] == cur['ops']:
+            # Measures nothing but the failure path
+            regressions.append(f"{name}: all {cur['ops']} ops failed")
+        base = baseline.get(name)
+        if not base:
+            continue
+        for key in ('p95_ms', 'p99_ms'):
+            if base[key] and cur[key] > base[key] * (1 + tolerance):
+                regressions.append(f"{name}: {key} {cur[key]} > baseline {base[key]}")
+        if base['throughput'] and cur['throughput'] < base['throughput'] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {cur['throughput']} < baseline {base['throughput']}")
+        if base['peak_kb'] and cur['peak_kb'] > base['peak_kb'] * (1 + tolerance):
+            regressions.append(f"{name}: peak_kb {cur['peak_kb']} > baseline {base['peak_kb']}")
+    return regressions
+
+
+def print_table(results):
+    cols = ('ops', 'errors', 'throughput', 'p50_ms', 'p95_ms', 'p99_ms', 'peak_kb')
+    print(f"{'scenario':<24}" + ''.join(f"{c:>12}" for c in cols))
+    for name, r in results.items():
+        print(f"{name:<24}" + ''.join(f"{r[c]:>12}" for c in cols))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark against recorded upstream fixtures.")
+    parser.add_argument('--only', choices=sorted(SUITES), action='append', help="Run only these suites")
+    parser.add_argument('--iterations', type=int, default=60)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.02, help="Stub response delay (s)")
+    parser.add_argument('--jitter', type=float, default=0.01, help="Random +/- delay (s)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of 500 responses")
+    parser.add_argument('--rate-429', type=float, default=0.0, help="Fraction of 429 responses")
+    parser.add_argument('--limiter-delay', type=float, default=0.01, help="Rate limiter min_delay for the limiter suite")
+    parser.add_argument('--page-scale', type=int, default=8, help="Bing/Yandex page size multiplier for the parse suite")
+    parser.add_argument('--parse-load', type=int, default=4, help="Background searching threads for the parse suite")
+    parser.add_argument('--parse-workers', type=int, default=4, help="PARSE_POOL workers for parse.pool")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed regression vs baseline")
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true')
+    args = parser.parse_args(argv)
+
+    args.stubs = start_stubs(args)
+    args.tmpdir = tempfile.mkdtemp(prefix='bench_')
+    LOCAL_INDEX.path = os.path.join(args.tmpdir, 'local_index.db')
+    results = {}
+    try:
+        for suite in args.only or list(SUITES):
+            for name, op in SUITES[suite](args).items():
+                if hasattr(op, 'setup'):
+                    op.setup()
+                try:
+                    results[name] = run_load(op, args.iterations, getattr(op, 'concurrency', args.concurrency))
+                finally:
+                    if hasattr(op, 'teardown'):
+                        op.teardown()
+    finally:
+        for stub in args.stubs.values():
+            stub.stop()
+        shutil.rmtree(args.tmpdir, ignore_errors=True)
+
+    print_table(results)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        failing = [name for name, r in results.items() if r['ops'] and r['errors'] == r['ops']]
+        for name in failing:
+            print(f"Not saving {name}: all ops failed")
+        baseline.update((name, r) for name, r in results.items() if name not in failing)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"\nBaseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("\nNo baseline found; run with --save-baseline to record one.")
+        return 0
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+    if regressions:
+        print("\nREGRESSIONS:")
+        for msg in regressions:
+            print(f"  {msg}")
+        return 1
+    print("\nNo regressions against baseline.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -18,6 +18,9 @@ source.dir = .
 # (list) Source files to include (let empty to include all the files)
 source.include_exts = py,png,jpg,kv,atlas,html,css,js,txt
 
+# (list) List of directory to exclude (let empty to not exclude anything)
+source.exclude_dirs = tests, bench_fixtures
+
 # (list) Application requirements
 # comma separated e.g. requirements = sqlite3,kivy
 # (list) Application requirements
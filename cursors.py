@@ -0,0 +1,62 @@
+"""
+Signed, stateless pagination cursors.
+
+A cursor is the engine's get_state() dict serialised as compact JSON,
+base64url-encoded and signed with HMAC-SHA256. Any worker sharing
+Q8_CURSOR_SECRET can resume the search without server-side session memory.
+"""
+import os
+import hmac
+import json
+import base64
+import hashlib
+import secrets
+
+SIG_BYTES = 12 # Truncated HMAC; plenty against forgery of a pagination token
+
+_secret = os.environ.get('Q8_CURSOR_SECRET')
+if not _secret:
+    # Cursors still work, but only within this process
+    print("[Cursor] Q8_CURSOR_SECRET not set; using a per-process key (cursors won't survive restarts or cross workers)")
+    _secret = secrets.token_hex(32)
+SECRET = _secret.encode('utf-8')
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def _sign(payload):
+    return hmac.new(SECRET, payload, hashlib.sha256).digest()[:SIG_BYTES]
+
+
+def encode(state):
+    payload = json.dumps(state, separators=(',', ':'), sort_keys=True).encode('utf-8')
+    return _b64encode(payload) + '.' + _b64encode(_sign(payload))
+
+
+def decode(token):
+    """Return the state dict, or raise InvalidCursor if tampered or malformed."""
+    try:
+        body, sig = token.split('.', 1)
+        payload = _b64decode(body)
+        valid = hmac.compare_digest(_b64decode(sig), _sign(payload))
+    except Exception:
+        raise InvalidCursor("Malformed cursor")
+    if not valid:
+        raise InvalidCursor("Bad cursor signature")
+    try:
+        state = json.loads(payload)
+    except ValueError:
+        raise InvalidCursor("Malformed cursor")
+    if not isinstance(state, dict) or 'e' not in state or 'q' not in state:
+        raise InvalidCursor("Incomplete cursor")
+    return state
@@ -0,0 +1,96 @@
+"""
+Saving images into the downloads folder, shared by the Flask and async APIs.
+"""
+import os
+import requests
+import metrics
+from flows import io, run, run_async
+from bandwidth import SCHEDULER
+
+DOWNLOAD_FOLDER = os.path.join(os.getcwd(), 'downloads')
+
+if not os.path.exists(DOWNLOAD_FOLDER):
+    os.makedirs(DOWNLOAD_FOLDER)
+
+
+def counted(chunks, kind):
+    """Pass chunks through while recording download bytes and in-flight transfers."""
+    metrics.DOWNLOADS_IN_FLIGHT.inc(kind)
+    try:
+        for chunk in chunks:
+            metrics.DOWNLOAD_BYTES.inc(kind, amount=len(chunk))
+            yield chunk
+    finally:
+        metrics.DOWNLOADS_IN_FLIGHT.dec(kind)
+
+
+def save_path(url):
+    """Free path in DOWNLOAD_FOLDER named after the URL."""
+    # Get filename from URL or default
+    filename = url.split('/')[-1].split('?')[0]
+    if not filename or len(filename) > 200:
+        filename = f"image_{abs(hash(url))}.jpg"
+
+    # Ensure extension
+    if '.' not in filename:
+         filename += ".jpg"
+
+    # Sanitize filename
+    filename = "".join([c for c in filename if c.isalpha() or c.isdigit() or c in '._- ']).strip()
+
+    path = os.path.join(DOWNLOAD_FOLDER, filename)
+
+    # Avoid overwrites
+    counter = 1
+    base_name, ext = os.path.splitext(filename)
+    while os.path.exists(path):
+        path = os.path.join(DOWNLOAD_FOLDER, f"{base_name}_{counter}{ext}")
+        counter += 1
+    return path
+
+
+def _copy(transfer, url, f):
+    with requests.get(url, timeout=15, stream=True) as response:
+        response.raise_for_status()
+        for chunk in transfer.throttle(response.iter_content(chunk_size=8192)):
+            metrics.DOWNLOAD_BYTES.inc('bulk', amount=len(chunk))
+            f.write(chunk)
+
+
+async def _copy_async(transfer, url, f):
+    import aio_http
+    # Chunks are small, so the local file writes don't stall the loop
+    async for chunk in transfer.throttle_async(aio_http.stream(url)):
+        metrics.DOWNLOAD_BYTES.inc('bulk', amount=len(chunk))
+        f.write(chunk)
+
+
+def _download(url, owner, priority):
+    """Flow (see flows.py) saving url once the scheduler admits it."""
+    path = None
+    try:
+        transfer = yield io(SCHEDULER.acquire, SCHEDULER.acquire_async, priority, owner, url)
+        metrics.DOWNLOADS_IN_FLIGHT.inc('bulk')
+        try:
+            path = save_path(url)
+            with open(path, 'wb') as f:
+                yield io(_copy, _copy_async, transfer, url, f)
+        finally:
+            metrics.DOWNLOADS_IN_FLIGHT.dec('bulk')
+            transfer.release()
+        return {'url': url, 'status': 'success', 'path': path}
+    except Exception as e:
+        # The file is opened before the status is known; don't leave it behind
+        if path and os.path.exists(path):
+            os.remove(path)
+        return {'url': url, 'status': 'error', 'error': str(e)}
+
+
+def download_single_image(url, owner='local', priority='bulk'):
+    """Save url into DOWNLOAD_FOLDER once the scheduler admits it."""
+    return run(_download(url, owner, priority))
+
+
+async def download_image_async(url, owner='local', priority='bulk'):
+    """download_single_image() on the event loop; waiting costs no thread."""
+    return await run_async(_download(url, owner, priority))
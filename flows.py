@@ -0,0 +1,62 @@
+"""
+Blocking and asyncio versions of the same code, written once.
+
+Logic that both paths need is a generator ("flow") that yields
+io(blocking_fn, async_fn, *args) wherever it would block. run() calls
+blocking_fn(*args) and sends the result back into the flow; run_async()
+awaits async_fn(*args) instead. Errors are thrown back in at the yield, so
+try/except/finally inside a flow work as in plain code. Only the I/O
+primitives exist twice; everything around them exists once.
+"""
+
+
+class io:
+    """One blocking step of a flow and its asyncio counterpart."""
+    __slots__ = ('blocking', 'coroutine', 'args', 'kwargs')
+
+    def __init__(self, blocking, coroutine, *args, **kwargs):
+        self.blocking = blocking
+        self.coroutine = coroutine
+        self.args = args
+        self.kwargs = kwargs
+
+
+def _advance(flow, value, error):
+    """Next step of flow, or raise StopIteration with its return value."""
+    if error is not None:
+        return flow.throw(error)
+    return flow.send(value)
+
+
+def run(flow):
+    """Run a flow to completion in this thread; returns its return value."""
+    value, error = None, None
+    try:
+        while True:
+            try:
+                step = _advance(flow, value, error)
+            except StopIteration as stop:
+                return stop.value
+            try:
+                value, error = step.blocking(*step.args, **step.kwargs), None
+            except Exception as e:
+                value, error = None, e
+    finally:
+        flow.close()
+
+
+async def run_async(flow):
+    """run() on the event loop: each step's coroutine is awaited."""
+    value, error = None, None
+    try:
+        while True:
+            try:
+                step = _advance(flow, value, error)
+            except StopIteration as stop:
+                return stop.value
+            try:
+                value, error = await step.coroutine(*step.args, **step.kwargs), None
+            except Exception as e:
+                value, error = None, e
+    finally:
+        flow.close()
@@ -0,0 +1,166 @@
+"""
+Header-only image dimension probing.
+
+Fetches just the first few KB of an image with a Range request and reads
+width/height from the PNG, GIF, JPEG, WebP or BMP header, so results can be
+filtered by resolution before anyone downloads the full file.
+"""
+import struct
+import asyncio
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from flows import io, run, run_async
+from metrics import PROBES
+
+PROBE_BYTES = 16384 # Enough for nearly all headers (JPEG SOF may follow EXIF)
+PROBE_TIMEOUT = 5
+
+# Minimum (long side, short side) for each size option
+MIN_RESOLUTION = {
+    'Wallpaper': (1920, 1080),
+    '2k': (2560, 1440),
+    '4k': (3840, 2160),
+    '8k': (7680, 4320),
+}
+
+PROBE_EXECUTOR = ThreadPoolExecutor(max_workers=16, thread_name_prefix='probe')
+
+# JPEG start-of-frame markers carry the dimensions (C4, C8 and CC are not SOFs)
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def parse_image_size(data):
+    """Return (width, height) from the start of an image file, or None."""
+    if data[:8] == b'\x89PNG\r\n\x1a\n' and len(data) >= 24:
+        return struct.unpack('>II', data[16:24])
+
+    if data[:6] in (b'GIF87a', b'GIF89a') and len(data) >= 10:
+        return struct.unpack('<HH', data[6:10])
+
+    if data[:2] == b'\xff\xd8':
+        return _parse_jpeg(data)
+
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP' and len(data) >= 30:
+        chunk = data[12:16]
+        if chunk == b'VP8 ':
+            w, h = struct.unpack('<HH', data[26:30])
+            return w & 0x3fff, h & 0x3fff
+        if chunk == b'VP8L':
+            b = data[21:25]
+            w = 1 + (((b[1] & 0x3f) << 8) | b[0])
+            h = 1 + (((b[3] & 0x0f) << 10) | (b[2] << 2) | ((b[1] & 0xc0) >> 6))
+            return w, h
+        if chunk == b'VP8X':
+            w = 1 + int.from_bytes(data[24:27], 'little')
+            h = 1 + int.from_bytes(data[27:30], 'little')
+            return w, h
+
+    if data[:2] == b'BM' and len(data) >= 26:
+        w, h = struct.unpack('<ii', data[18:26])
+        return w, abs(h)
+
+    return None
+
+
+def _parse_jpeg(data):
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF: # Fill byte
+            i += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7: # No length field
+            i += 2
+            continue
+        length = struct.unpack('>H', data[i + 2:i + 4])[0]
+        if marker in _JPEG_SOF:
+            h, w = struct.unpack('>HH', data[i + 5:i + 9])
+            return w, h
+        i += 2 + length
+    return None
+
+
+def _get_prefix(url, headers):
+    """(status, first PROBE_BYTES of the body)."""
+    # Servers that ignore Range still only get read up to PROBE_BYTES
+    with requests.get(url, headers=headers, stream=True, timeout=PROBE_TIMEOUT) as res:
+        if res.status_code not in (200, 206):
+            return res.status_code, b''
+        data = b''
+        for chunk in res.iter_content(chunk_size=4096):
+            data += chunk
+            if len(data) >= PROBE_BYTES:
+                break
+        return res.status_code, data
+
+
+async def _get_prefix_async(url, headers):
+    import aio_http
+    return await aio_http.get_prefix(url, PROBE_BYTES, headers, PROBE_TIMEOUT)
+
+
+def _probe(url, headers):
+    """Flow (see flows.py) behind probe_size() and probe_size_async()."""
+    req_headers = dict(headers or {})
+    req_headers['Range'] = f'bytes=0-{PROBE_BYTES - 1}'
+    try:
+        status, data = yield io(_get_prefix, _get_prefix_async, url, req_headers)
+        if status not in (200, 206):
+            return None
+        return parse_image_size(data)
+    except Exception as e:
+        print(f"[Probe] {url[:60]}: {e}")
+        return None
+
+
+def probe_size(url, headers=None):
+    """Read only the first PROBE_BYTES of url and parse its dimensions."""
+    return run(_probe(url, headers))
+
+
+async def probe_size_async(url, headers=None):
+    """probe_size() on the shared aiohttp session."""
+    return await run_async(_probe(url, headers))
+
+
+def _missing(results):
+    missing = [r for r in results if not (r.width and r.height) and r.image]
+    PROBES.inc('metadata', amount=len(results) - len(missing))
+    return missing
+
+
+def _apply_sizes(missing, sizes):
+    for r, size in zip(missing, sizes):
+        if size:
+            r.width, r.height = size
+            PROBES.inc('ok')
+        else:
+            PROBES.inc('failed')
+
+
+def fill_dimensions(results, headers=None):
+    """Set width/height on results missing them, probing concurrently."""
+    missing = _missing(results)
+    if missing:
+        _apply_sizes(missing, PROBE_EXECUTOR.map(lambda r: probe_size(r.image, headers), missing))
+    return results
+
+
+async def fill_dimensions_async(results, headers=None):
+    missing = _missing(results)
+    if missing:
+        _apply_sizes(missing, await asyncio.gather(*(probe_size_async(r.image, headers) for r in missing)))
+    return results
+
+
+def meets_size(result, size):
+    """True unless the result is known to be below the size option's resolution."""
+    if size not in MIN_RESOLUTION:
+        return True
+    w, h = result.width, result.height
+    if not (w and h):
+        return True # Unknown dimensions are kept rather than silently dropped
+    long_min, short_min = MIN_RESOLUTION[size]
+    return max(w, h) >= long_min and min(w, h) >= short_min
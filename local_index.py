@@ -0,0 +1,217 @@
+"""
+Local full-text index of every result seen and the search history.
+
+Engines hand their pages to LOCAL_INDEX.record(), which only enqueues; a
+background writer thread batches the inserts into SQLite. search() answers
+from the index alone (FTS5 over title, tags, source and query), so
+re-searches are instant and work offline.
+"""
+import os
+import time
+import queue
+import atexit
+import sqlite3
+import threading
+from metrics import INDEX_WRITES, INDEX_DROPPED
+from results import Result
+
+DB_PATH = os.environ.get('Q8_INDEX_PATH', os.path.join(os.getcwd(), 'local_index.db'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    image TEXT UNIQUE NOT NULL,
+    thumbnail TEXT,
+    url TEXT,
+    title TEXT,
+    source TEXT,
+    tags TEXT,
+    score INTEGER,
+    width INTEGER,
+    height INTEGER,
+    query TEXT,
+    first_seen REAL,
+    last_seen REAL,
+    seen_count INTEGER DEFAULT 1
+);
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY,
+    query TEXT,
+    engine TEXT,
+    size TEXT,
+    results INTEGER,
+    ts REAL
+);
+"""
+
+# External-content FTS table kept in sync by triggers
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS results_fts USING fts5(
+    title, tags, source, query,
+    content='results', content_rowid='id',
+    tokenize="unicode61 tokenchars '_'"
+);
+CREATE TRIGGER IF NOT EXISTS results_ai AFTER INSERT ON results BEGIN
+    INSERT INTO results_fts(rowid, title, tags, source, query) VALUES (new.id, new.title, new.tags, new.source, new.query);
+END;
+CREATE TRIGGER IF NOT EXISTS results_au AFTER UPDATE ON results BEGIN
+    INSERT INTO results_fts(results_fts, rowid, title, tags, source, query) VALUES ('delete', old.id, old.title, old.tags, old.source, old.query);
+    INSERT INTO results_fts(rowid, title, tags, source, query) VALUES (new.id, new.title, new.tags, new.source, new.query);
+END;
+CREATE TRIGGER IF NOT EXISTS results_ad AFTER DELETE ON results BEGIN
+    INSERT INTO results_fts(results_fts, rowid, title, tags, source, query) VALUES ('delete', old.id, old.title, old.tags, old.source, old.query);
+END;
+"""
+
+UPSERT = """
+INSERT INTO results (image, thumbnail, url, title, source, tags, score, width, height, query, first_seen, last_seen)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(image) DO UPDATE SET
+    last_seen = excluded.last_seen,
+    seen_count = seen_count + 1,
+    score = COALESCE(excluded.score, score),
+    width = MAX(width, excluded.width),
+    height = MAX(height, excluded.height)
+"""
+
+COLUMNS = ('image', 'thumbnail', 'url', 'title', 'source', 'tags', 'score', 'width', 'height')
+
+
+class LocalIndex:
+    def __init__(self, path=DB_PATH, batch_size=500, flush_interval=1.0, max_pending=20000):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.local = threading.local() # One reader connection per thread
+        self.lock = threading.Lock()
+        self.writer = None
+        self.fts = True
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _ensure_started(self):
+        if self.writer:
+            return
+        with self.lock:
+            if self.writer:
+                return
+            conn = self._connect()
+            conn.executescript(SCHEMA)
+            try:
+                conn.executescript(FTS_SCHEMA)
+            except sqlite3.OperationalError as e:
+                # SQLite builds without FTS5 fall back to LIKE scans
+                print(f"[Index] FTS5 unavailable ({e}); using LIKE search")
+                self.fts = False
+            conn.close()
+            self.writer = threading.Thread(target=self._write_loop, name='local-index', daemon=True)
+            self.writer.start()
+            atexit.register(self.flush)
+
+    # --- Writes (off the request path) ---
+
+    def record(self, query, engine, size, results, new_search=False):
+        """Queue a page of results (and optionally a history row). Never blocks."""
+        self._put((query, engine, size, results, len(results) if new_search else None, time.time()))
+
+    def record_search(self, query, engine, size, count):
+        """Queue only a history row, for results indexed by another engine."""
+        self._put((query, engine, size, [], count, time.time()))
+
+    def _put(self, item):
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            INDEX_DROPPED.inc(amount=len(item[3]))
+
+    def _write_loop(self):
+        conn = self._connect()
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            rows = len(batch[0][3])
+            while rows < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                rows += len(item[3])
+            try:
+                self._write_batch(conn, batch)
+            except Exception as e:
+                print(f"[Index] Write failed: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _write_batch(self, conn, batch):
+        result_rows = []
+        history_rows = []
+        for query, engine, size, results, history_count, ts in batch:
+            for r in results:
+                if not r.image:
+                    continue
+                result_rows.append([getattr(r, c) for c in COLUMNS] + [query, ts, ts])
+            if history_count is not None:
+                history_rows.append((query, engine, size, history_count, ts))
+        with conn:
+            conn.executemany(UPSERT, result_rows)
+            conn.executemany('INSERT INTO history (query, engine, size, results, ts) VALUES (?, ?, ?, ?, ?)', history_rows)
+        INDEX_WRITES.inc(amount=len(result_rows))
+
+    def flush(self):
+        """Wait until everything queued so far is written."""
+        if self.writer:
+            self.queue.join()
+
+    # --- Reads ---
+
+    def _reader(self):
+        self._ensure_started()
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = self._connect()
+        return conn
+
+    def search(self, text, limit=50, offset=0, source=None):
+        """Best-matching previously seen results for free text / tags."""
+        terms = text.split()
+        if not terms:
+            return []
+        conn = self._reader()
+        if self.fts:
+            # Every term as a quoted prefix so user input can't break FTS syntax
+            match = ' '.join('"' + t.replace('"', '""') + '"*' for t in terms)
+            sql = ("SELECT r.* FROM results_fts JOIN results r ON r.id = results_fts.rowid "
+                   "WHERE results_fts MATCH ?")
+            params = [match]
+        else:
+            sql = "SELECT r.* FROM results r WHERE " + ' AND '.join(
+                "(r.title LIKE ? OR r.tags LIKE ? OR r.query LIKE ?)" for _ in terms)
+            params = [f"%{t}%" for t in terms for _ in range(3)]
+        if source:
+            sql += " AND r.source = ?"
+            params.append(source)
+        sql += (" ORDER BY rank, r.last_seen DESC" if self.fts else " ORDER BY r.last_seen DESC") + " LIMIT ? OFFSET ?"
+        params += [limit, offset]
+        return [Result.from_row(row) for row in conn.execute(sql, params)]
+
+    def history(self, limit=50):
+        """Most recent searches, newest first."""
+        conn = self._reader()
+        rows = conn.execute('SELECT query, engine, size, results, ts FROM history ORDER BY id DESC LIMIT ?', (limit,))
+        return [dict(row) for row in rows]
+
+
+LOCAL_INDEX = LocalIndex()
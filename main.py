@@ -20,6 +20,7 @@ try:
     from kivy.uix.floatlayout import FloatLayout
     from kivy.properties import StringProperty, BooleanProperty, NumericProperty
     from kivy.clock import Clock
+    from kivy.metrics import dp
     from kivy.utils import platform
     from kivy.loader import Loader
     from kivy.core.window import Window
@@ -94,8 +95,8 @@ try:
         def load_image(self):
             if not self.data_list: return
             item = self.data_list[self.current_index]
-            self.img.source = item['image']
-            self.lbl_info.text = f"{self.current_index + 1}/{len(self.data_list)}: {item.get('title', '')}"
+            self.img.source = item.image
+            self.lbl_info.text = f"{self.current_index + 1}/{len(self.data_list)}: {item.title or ''}"
             self.btn_prev.disabled = (self.current_index == 0)
             self.btn_next.disabled = (self.current_index == len(self.data_list) - 1)
 
@@ -123,14 +124,76 @@ try:
         def on_image_click(self):
             App.get_running_app().root.open_viewer(self.index)
 
+    class FetchWorker:
+        """
+        The single background fetch thread of one search. request() is a
+        no-op while a fetch is running or the engine is exhausted, so
+        scroll events and button taps never stack up parallel fetches.
+        """
+        # fetch_next_batch() also returns [] when a request fails, so one
+        # empty page only pauses prefetching until the user taps Load More;
+        # this many in a row end the search
+        MAX_EMPTY_PAGES = 3
+
+        def __init__(self, engine, on_done, on_error):
+            self.engine = engine
+            self.on_done = on_done
+            self.on_error = on_error
+            self.wanted = threading.Event()
+            self.busy = False
+            self.stopped = False
+            self.empty_pages = 0
+            self.exhausted = False
+            threading.Thread(target=self._run, daemon=True).start()
+
+        def request(self, manual=True):
+            """Ask for the next page. Returns True if a fetch was started."""
+            if self.busy or self.exhausted or self.stopped:
+                return False
+            if self.empty_pages and not manual:
+                return False
+            self.busy = True
+            self.wanted.set()
+            return True
+
+        def stop(self):
+            self.stopped = True
+            self.wanted.set()
+
+        def _run(self):
+            while True:
+                self.wanted.wait()
+                self.wanted.clear()
+                if self.stopped: return
+                try:
+                    new_items = self.engine.fetch_next_batch()
+                    self.empty_pages = 0 if new_items else self.empty_pages + 1
+                    self.exhausted = self.empty_pages >= self.MAX_EMPTY_PAGES
+                    Clock.schedule_once(lambda dt, items=new_items: self._finish(self.on_done, items))
+                except Exception as e:
+                    print(f"Fetch Error: {e}")
+                    err = str(e)
+                    Clock.schedule_once(lambda dt, err=err: self._finish(self.on_error, err))
+
+        def _finish(self, callback, value):
+            # Runs on the UI thread; results of a replaced search are dropped
+            self.busy = False
+            if not self.stopped:
+                callback(value)
+
     class RootWidget(BoxLayout):
         has_results = BooleanProperty(False)
+        # Start loading the next page when the user scrolls within this many
+        # pixels of the end of the grid
+        prefetch_distance = NumericProperty(dp(1200))
         
         def __init__(self, **kwargs):
             super().__init__(**kwargs)
             self.engine = None
+            self.fetcher = None
             self.current_results = [] 
             self.selected_indices = set()
+            Clock.schedule_once(lambda dt: self.ids.rv.bind(scroll_y=self._on_scroll))
             
         def do_search(self):
             try:
@@ -148,9 +211,12 @@ try:
                 e_norm = engine_name.lower()
                 if e_norm == 'rule34': e_norm = 'rule34'
                 elif e_norm == 'duckduckgo': e_norm = 'ddg'
+                elif e_norm == 'offline': e_norm = 'local' # Previously seen results only
                 else: e_norm = 'bing'
                 
-                self.engine = get_engine(e_norm, query, size=size_val if size_val != 'Any Size' else None)
+                self.engine = get_engine(e_norm, query, size=size_val if size_val != 'Any Size' else None, new_search=True)
+                if self.fetcher: self.fetcher.stop()
+                self.fetcher = FetchWorker(self.engine, self._on_fetch_complete, self._on_error)
                 self.load_more()
             except Exception as e:
                 # Show Error Popup
@@ -159,43 +225,53 @@ try:
                 p.open()
                 print(f"Search Crash: {e}")
             
-        def load_more(self):
-            if not self.engine: return
-            self.ids.load_more_btn.text = "Loading..."
-            self.ids.load_more_btn.disabled = True
-            threading.Thread(target=self._fetch_thread, daemon=True).start()
-            
-        def _fetch_thread(self):
-            try:
-                new_items = self.engine.fetch_next_batch()
-                Clock.schedule_once(lambda dt: self._on_fetch_complete(new_items))
-            except Exception as e:
-                print(f"Fetch Error: {e}")
-                Clock.schedule_once(lambda dt: self._on_error(str(e)))
+        def load_more(self, manual=True):
+            if not self.fetcher: return
+            if self.fetcher.request(manual):
+                self.ids.load_more_btn.text = "Loading..."
+                self.ids.load_more_btn.disabled = True
+
+        def _on_scroll(self, rv, scroll_y):
+            self._maybe_prefetch()
+
+        def _maybe_prefetch(self, *args):
+            """Fetch the next page if the end of the grid is within prefetch_distance."""
+            if not self.fetcher: return
+            rv = self.ids.rv
+            scrollable = rv.layout_manager.height - rv.height if rv.layout_manager else 0
+            # scroll_y is 1 at the top and 0 at the bottom
+            if scrollable <= 0 or rv.scroll_y * scrollable <= self.prefetch_distance:
+                self.load_more(manual=False)
             
         def _on_error(self, err_msg):
             self.ids.load_more_btn.text = f"Error: {err_msg[:20]}"
             self.ids.load_more_btn.disabled = False
             
         def _on_fetch_complete(self, new_items):
+            if not new_items:
+                if self.fetcher.exhausted:
+                    self.ids.load_more_btn.text = "No more results"
+                    self.ids.load_more_btn.disabled = True
+                else:
+                    # Possibly a failed request; let the user try again
+                    self.ids.load_more_btn.text = "Nothing loaded - Retry"
+                    self.ids.load_more_btn.disabled = False
+                return
             self.ids.load_more_btn.disabled = False
             self.ids.load_more_btn.text = "Load More"
-            if not new_items: return
 
             start = len(self.current_results)
             self.current_results.extend(new_items)
             
-            rv_data = []
-            for i, item in enumerate(self.current_results):
-                rv_data.append({
-                    'thumbnail': item.get('thumbnail', ''),
-                    'image_url': item.get('image', ''),
-                    'source': item.get('source', ''),
-                    'index': i,
-                    'selected': i in self.selected_indices
-                })
-            self.ids.rv.data = rv_data
+            # Only the new page is converted; existing view data is kept as is
+            self.ids.rv.data.extend(
+                item.to_view(start + i, (start + i) in self.selected_indices)
+                for i, item in enumerate(new_items)
+            )
             self.has_results = True
+            # Keep going while the grid doesn't reach prefetch_distance past the
+            # viewport (checked after the layout has grown)
+            Clock.schedule_once(self._maybe_prefetch, 0.2)
 
         def open_viewer(self, index):
             if 0 <= index < len(self.current_results):
@@ -249,7 +325,7 @@ try:
             # 2. Download Loop
             for item in items:
                 try:
-                    url = item['image']
+                    url = item.image
                     ext = url.split('.')[-1].split('?')[0]
                     if len(ext) > 4 or not ext: ext = "jpg"
                     
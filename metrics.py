@@ -0,0 +1,178 @@
+"""
+Minimal in-process metrics with Prometheus text exposition.
+
+Label values are passed positionally so the hot path is one dict lookup and
+one short lock per update:
+
+    ENGINE_REQUESTS.inc('bing')
+    ENGINE_LATENCY.observe(0.42, 'bing')
+"""
+import bisect
+import threading
+
+REGISTRY = []
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 15.0)
+
+
+def _label_str(names, values, extra=''):
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _fmt(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+        REGISTRY.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            items = list(self.values.items())
+        for key, value in sorted(items):
+            lines.append(f"{self.name}{_label_str(self.labels, key)} {_fmt(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def get(self, *labels):
+        return self.values.get(labels, 0)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, labels=(), func=None):
+        super().__init__(name, help_text, labels)
+        self.func = func # Sampled at scrape time (unlabelled gauges only)
+
+    def set(self, value, *labels):
+        with self.lock:
+            self.values[labels] = value
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def get(self, *labels):
+        if self.func:
+            return self.func()
+        return self.values.get(labels, 0)
+
+    def render(self):
+        if self.func:
+            try:
+                self.set(self.func())
+            except Exception as e:
+                print(f"[Metrics] {self.name} callback failed: {e}")
+        return super().render()
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        idx = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(labels)
+            if state is None:
+                # [per-bucket counts (+Inf last), sum, count]
+                state = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][idx] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            items = [(k, (list(v[0]), v[1], v[2])) for k, v in self.values.items()]
+        for key, (counts, total, count) in sorted(items):
+            cumulative = 0
+            for bound, c in zip(self.buckets + (float('inf'),), counts):
+                cumulative += c
+                le = 'le="' + _fmt(float(bound)) + '"'
+                lines.append(f"{self.name}_bucket{_label_str(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_str(self.labels, key)} {_fmt(total)}")
+            lines.append(f"{self.name}_count{_label_str(self.labels, key)} {count}")
+        return lines
+
+
+def render():
+    """All registered metrics in Prometheus text format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# --- Engine layer ---
+ENGINE_REQUESTS = Counter('q8_engine_requests_total', 'Engine page fetches.', ('engine',))
+ENGINE_LATENCY = Histogram('q8_engine_latency_seconds', 'Engine page fetch latency.', ('engine',))
+ENGINE_RESULTS = Counter('q8_engine_results_total', 'Results parsed from upstream pages.', ('engine',))
+ENGINE_ERRORS = Counter('q8_engine_errors_total', 'Engine fetch errors (network, parse, HTTP >= 400).', ('engine',))
+UPSTREAM_429 = Counter('q8_upstream_429_total', 'HTTP 429 responses from upstream.', ('engine',))
+COALESCED = Counter('q8_singleflight_coalesced_total', 'Fetches served by joining an identical in-flight request.', ('engine',))
+PROBES = Counter('q8_probe_total', 'Result dimension lookups by source (metadata, ok, failed).', ('outcome',))
+SIZE_FILTERED = Counter('q8_size_filtered_total', 'Results dropped for being below the requested resolution.', ('engine',))
+HEDGES = Counter('q8_hedges_total', 'Hedged backup requests by outcome.', ('outcome',))
+
+# --- Local index ---
+INDEX_WRITES = Counter('q8_index_rows_written_total', 'Result rows written to the local index.')
+INDEX_DROPPED = Counter('q8_index_rows_dropped_total', 'Result rows dropped because the index write queue was full.')
+
+# --- Watch-list ---
+WATCH_POLLS = Counter('q8_watch_polls_total', 'Watch-list delta requests sent to Rule34.')
+WATCH_NEW_ITEMS = Counter('q8_watch_new_items_total', 'New posts found by watch-list polls.')
+
+# --- Tag index ---
+TAG_SYNC_PAGES = Counter('q8_tag_sync_pages_total', 'Rule34 tag-list pages fetched by the tag sync.')
+TAGS_REJECTED = Counter('q8_tags_rejected_total', 'Rule34 queries rejected locally for unknown tags.')
+
+# --- Rate limiter ---
+LIMITER_WAIT = Histogram('q8_ratelimit_wait_seconds', 'Time spent waiting for a Rule34 request slot.',
+                         buckets=(0.001, 0.01, 0.1, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0))
+LIMITER_QUEUE = Gauge('q8_ratelimit_queue_depth', 'Threads waiting for a Rule34 request slot.')
+
+# --- Server ---
+SESSIONS = Gauge('q8_search_sessions', 'Live search sessions held in memory.')
+DOWNLOAD_BYTES = Counter('q8_download_bytes_total', 'Bytes transferred from upstream by downloads (rate() for bytes/sec).', ('kind',))
+DOWNLOADS_IN_FLIGHT = Gauge('q8_downloads_in_flight', 'Download transfers currently running.', ('kind',))
+
+# --- Transfer scheduler ---
+TRANSFERS_ACTIVE = Gauge('q8_transfers_active', 'Outbound transfers holding a scheduler slot.', ('priority',))
+TRANSFERS_QUEUED = Gauge('q8_transfers_queued', 'Outbound transfers waiting for a scheduler slot.', ('priority',))
+TRANSFER_WAIT = Histogram('q8_transfer_wait_seconds', 'Time transfers waited for a scheduler slot.', ('priority',),
+                          buckets=(0.001, 0.01, 0.1, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0))
@@ -0,0 +1,126 @@
+"""
+Parsers for the large HTML result pages (Bing, Yandex), kept apart from the
+fetch code so they can run in worker processes.
+
+Regex scans over a few hundred KB hold the GIL; run in the request thread
+they stall every other Flask thread and download stream. PARSE_POOL runs
+them in a process pool instead. The parsers work on the raw response bytes,
+so the body is never decoded to str in the request thread.
+
+Workers come from a forkserver (spawn where there is none), never a plain
+fork: forking a server with live threads can copy a held lock into the
+child. Like spawned processes they re-import the main module, so the pool
+is only started on the first large page.
+"""
+import os
+import re
+import asyncio
+import threading
+from urllib.parse import unquote
+from concurrent.futures import BrokenExecutor
+from results import Result
+
+_BING_MURL = (re.compile(rb'murl&quot;:&quot;([^&]+)&quot;'), re.compile(rb'"murl":"([^"]+)"'))
+_BING_TURL = (re.compile(rb'turl&quot;:&quot;([^&]+)&quot;'), re.compile(rb'"turl":"([^"]+)"'))
+_YANDEX_URL = re.compile(rb'"https?://[^"]+"')
+
+
+def _findall(patterns, body):
+    # Escaped JSON first, then plain
+    for pattern in patterns:
+        found = pattern.findall(body)
+        if found:
+            return found
+    return []
+
+
+def parse_bing(body):
+    # Bing often gives "murl" (Main URL) and "turl" (Thumbnail URL)
+    links = _findall(_BING_MURL, body)
+    thumbs = _findall(_BING_TURL, body)
+
+    formatted_results = []
+    for i, link in enumerate(links):
+        # Clean URL
+        full_url = unquote(link.decode('utf-8', 'replace'))
+        # Ensure thumbnail is available
+        thumb_url = unquote(thumbs[i].decode('utf-8', 'replace')) if i < len(thumbs) else full_url
+
+        formatted_results.append(Result(full_url, thumb_url, 'Bing Image', 'Bing'))
+
+    return formatted_results
+
+
+def parse_yandex(body):
+    # Looking for img_href or similar in JSON data blobs
+    matches = _YANDEX_URL.findall(body)
+    images = [m.strip(b'"') for m in matches if any(x in m for x in (b'.jpg', b'.png', b'.jpeg')) and b'avatars.mds.yandex.net' not in m]
+    images = list(set(images))
+
+    formatted = []
+    for img in images[:40]:
+         img = img.decode('utf-8', 'replace')
+         # Yandex scrape doesn't give separate thumb easily yet
+         formatted.append(Result(img, img, 'Yandex Result', 'Yandex', img))
+
+    return formatted
+
+
+class ParsePool:
+    """
+    Runs a parser on a response body, in a worker process when enabled.
+    workers=0 parses inline (the Kivy client; Android has no process pools).
+    """
+    def __init__(self, workers=0, min_size=32768):
+        self.workers = workers
+        self.min_size = min_size # Smaller bodies parse faster than the IPC round trip
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def _offload(self, body):
+        return self.workers > 0 and len(body) >= self.min_size
+
+    def _pool(self):
+        with self.lock:
+            if self.executor is None:
+                # Imported here so the Kivy client never loads multiprocessing
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+                self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+            return self.executor
+
+    def _broken(self, e):
+        print(f"[Parse] Worker pool failed ({e}); parsing inline")
+        with self.lock:
+            self.executor = None
+
+    def run(self, parser, body):
+        if not self._offload(body):
+            return parser(body)
+        try:
+            # Bytes are pickled straight to the worker; the request thread
+            # just waits without holding the GIL
+            return self._pool().submit(parser, body).result()
+        except BrokenExecutor as e:
+            self._broken(e)
+            return parser(body)
+
+    async def run_async(self, parser, body):
+        if not self._offload(body):
+            return parser(body)
+        try:
+            return await asyncio.wrap_future(self._pool().submit(parser, body))
+        except BrokenExecutor as e:
+            self._broken(e)
+            return parser(body)
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = None
+
+
+PARSE_POOL = ParsePool(workers=int(os.environ.get('Q8_PARSE_WORKERS', 0)))
@@ -0,0 +1,87 @@
+"""
+Compact result record shared by all engines, the server and the Kivy app.
+
+A slotted object instead of a dict per result: no per-instance __dict__ and
+no repeated key strings, which matters for deep sessions holding tens of
+thousands of results. It serialises straight to the JSON payload and to
+RecycleView data.
+
+JSON omits empty/default fields: a missing key means null/0. The columnar
+encoding also nulls thumbnails that equal the image. Rule34's id, score and
+tags are only sent when asked for.
+"""
+
+
+class Result:
+    __slots__ = ('image', 'thumbnail', 'title', 'source', 'url', 'width', 'height', 'id', 'score', 'tags')
+    # Left out of JSON unless requested; tags alone can outweigh the rest
+    OPTIONAL_FIELDS = ('id', 'score', 'tags')
+
+    def __init__(self, image, thumbnail=None, title=None, source=None, url=None,
+                 width=0, height=0, id=None, score=None, tags=None):
+        self.image = image
+        self.thumbnail = thumbnail
+        self.title = title
+        self.source = source
+        self.url = url
+        self.width = width or 0
+        self.height = height or 0
+        # Rule34 only
+        self.id = id
+        self.score = score
+        self.tags = tags
+
+    @classmethod
+    def from_row(cls, row):
+        """Build from a local index row (sqlite3.Row or mapping)."""
+        return cls(row['image'], row['thumbnail'], row['title'], row['source'], row['url'],
+                   row['width'], row['height'], score=row['score'], tags=row['tags'])
+
+    def _json_value(self, field):
+        """Value to serialise, or None when it is empty or the default."""
+        value = getattr(self, field)
+        if value == '' or value == 0 and field != 'score':
+            return None
+        return value
+
+    @classmethod
+    def json_fields(cls, extra=()):
+        """Fields to serialise: the default ones plus the optional ones in extra."""
+        return tuple(f for f in cls.__slots__ if f not in cls.OPTIONAL_FIELDS or f in extra)
+
+    def to_json(self, fields=None):
+        data = {}
+        for field in fields or self.json_fields():
+            value = self._json_value(field)
+            if value is not None:
+                data[field] = value
+        return data
+
+    @staticmethod
+    def columnar(results, fields=None):
+        """
+        Batch encoding with each key once: {"count": n, "columns": {field: [...]}}.
+        Only fields set on at least one result are included, and a null
+        thumbnail means "same as image".
+        """
+        columns = {}
+        for field in fields or Result.json_fields():
+            values = [r._json_value(field) for r in results]
+            if field == 'thumbnail':
+                values = [None if v == r.image else v for v, r in zip(values, results)]
+            if any(v is not None for v in values):
+                columns[field] = values
+        return {'count': len(results), 'columns': columns}
+
+    def to_view(self, index, selected=False):
+        """RecycleView data for an ImageCard."""
+        return {
+            'thumbnail': self.thumbnail or '',
+            'image_url': self.image or '',
+            'source': self.source or '',
+            'index': index,
+            'selected': selected,
+        }
+
+    def __repr__(self):
+        return f"Result({self.source}: {self.image})"
@@ -1,17 +1,172 @@
 import requests
 import re
 import json
+import math
+import heapq
 import random
 import time
-from urllib.parse import unquote
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from metrics import ENGINE_REQUESTS, ENGINE_LATENCY, ENGINE_RESULTS, ENGINE_ERRORS, UPSTREAM_429, HEDGES, COALESCED, SIZE_FILTERED, TAGS_REJECTED
+from image_probe import fill_dimensions, fill_dimensions_async, meets_size, MIN_RESOLUTION
+from local_index import LOCAL_INDEX
+from results import Result
+from page_parsers import PARSE_POOL, parse_bing, parse_yandex
+from flows import io, run, run_async
+
+# Upstream endpoints (overridable, e.g. by benchmark.py's stub servers)
+BING_URL = "https://www.bing.com/images/search"
+DDG_URL = "https://duckduckgo.com/"
+DDG_IMAGES_URL = "https://duckduckgo.com/i.js"
+YANDEX_URL = "https://yandex.com/images/search"
+
+class LatencyTracker:
+    """Rolling per-engine latency samples used to learn hedge thresholds."""
+    def __init__(self, window=200, min_samples=20, default=2.0):
+        self.window = window
+        self.min_samples = min_samples
+        self.default = default # Used until enough samples are observed
+        self.lock = threading.Lock()
+        self.samples = {}
+
+    def observe(self, name, seconds):
+        with self.lock:
+            if name not in self.samples:
+                self.samples[name] = deque(maxlen=self.window)
+            self.samples[name].append(seconds)
+
+    def percentile(self, name, pct=0.95):
+        with self.lock:
+            data = sorted(self.samples.get(name, ()))
+        if len(data) < self.min_samples:
+            return self.default
+        return data[min(len(data) - 1, int(pct * len(data)))]
+
+class HedgeBudget:
+    """
+    Token bucket that caps hedges to a fraction of primary requests. Also
+    counts losers still running after their race was decided: past
+    max_orphans no new hedges start, so abandoned fetches can't fill
+    HEDGE_EXECUTOR.
+    """
+    def __init__(self, ratio=0.1, burst=5, max_orphans=8):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = float(burst)
+        self.max_orphans = max_orphans
+        self.orphans = 0
+        self.lock = threading.Lock()
+
+    def abandon(self, fut):
+        """Cancel a loser if it can still be cancelled, else count it until done."""
+        fut.cancel() # Queued futures and asyncio tasks stop; running threads can't
+        with self.lock:
+            self.orphans += 1
+        fut.add_done_callback(self._orphan_done)
+
+    def _orphan_done(self, _):
+        with self.lock:
+            self.orphans -= 1
+
+    def record_request(self):
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def try_spend(self):
+        with self.lock:
+            if self.orphans >= self.max_orphans:
+                return False
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+class SingleFlight:
+    """
+    Deduplicates identical in-flight upstream fetches. The first caller for a
+    key runs the fetch; concurrent callers with the same key wait and get
+    the same parsed page instead of issuing their own request.
+    """
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.tasks = {} # (event loop, key) -> shared task for do_async()
+
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = self._Call()
+        
+        if not leader:
+            COALESCED.inc(key[0])
+            call.done.wait()
+            if call.error: raise call.error
+            return call.result
+        
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result
+
+    async def do_async(self, key, fn):
+        """do() for coroutine functions; waiters await the leader's task."""
+        task_key = (asyncio.get_running_loop(), key)
+        with self.lock:
+            task = self.tasks.get(task_key)
+            if task is None:
+                task = self.tasks[task_key] = asyncio.ensure_future(fn())
+                task.add_done_callback(lambda _: self._forget(task_key))
+            else:
+                COALESCED.inc(key[0])
+        # A cancelled waiter must not cancel the fetch the others share
+        return await asyncio.shield(task)
+
+    def _forget(self, task_key):
+        with self.lock:
+            self.tasks.pop(task_key, None)
+
+# Shared across all sessions so thresholds and budget are process-wide
+LATENCY = LatencyTracker()
+HEDGE_BUDGET = HedgeBudget()
+HEDGE_EXECUTOR = ThreadPoolExecutor(max_workers=16, thread_name_prefix='hedge')
+FLIGHTS = SingleFlight()
+
+# Pages that may be fully filtered out by resolution before giving up
+MAX_FILTERED_PAGES = 5
 
 class SearchEngine:
+    name = 'base'
+    # Attributes that fully describe where the engine is in its result stream
+    state_fields = ('offset',)
+
     def __init__(self, query, size=None):
         self.original_query = query
         self.size = size
         self.query = self._format_query(query, size)
         self.offset = 0
-        self.offset = 0
+        # Probe missing dimensions and drop results below the size option
+        self.probe = size in MIN_RESOLUTION
+        # Feed every page into the local full-text index
+        self.index_results = True
+        # Set by get_engine(new_search=True): the first page adds a history
+        # row. Engines resumed from a cursor leave it off.
+        self.new_search = False
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         }
@@ -26,27 +181,191 @@ class SearchEngine:
             return f"{query} {size} wallpaper"
         return f"{query} {size}"
 
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not hasattr(self, '_buffer'):
+            self._buffer = []
+        
+        while not self._buffer:
+            new_results = self.fetch_next_batch()
+            if not new_results:
+                raise StopIteration
+            self._buffer.extend(new_results)
+        
+        return self._buffer.pop(0)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not hasattr(self, '_buffer'):
+            self._buffer = []
+        
+        while not self._buffer:
+            new_results = await self.fetch_next_batch_async()
+            if not new_results:
+                raise StopAsyncIteration
+            self._buffer.extend(new_results)
+        
+        return self._buffer.pop(0)
+
+    # Fetching is written once as flows (generators yielding io() steps, see
+    # flows.py); the plain methods run them blocking, the _async ones on the
+    # event loop.
+
     def fetch_next_batch(self):
+        return run(self._next_batch())
+
+    async def fetch_next_batch_async(self):
+        """fetch_next_batch() without blocking the event loop."""
+        return await run_async(self._next_batch())
+
+    def _next_batch(self):
+        start = time.monotonic()
+        results = []
         try:
-            return self._fetch_more()
+            results = yield io(self._fetch_more, self._fetch_more_async)
+            if self.probe:
+                results = yield from self._probe_and_filter(results)
+            self._index(results)
+            return results
         except Exception as e:
+            ENGINE_ERRORS.inc(self.name)
             print(f"Engine Error: {e}")
             return []
+        finally:
+            self._observe(start, results)
+
+    def _index(self, results):
+        # A first page with nothing on it still goes into the history
+        if self.index_results and (results or self.new_search):
+            LOCAL_INDEX.record(self.original_query, self.name, self.size, results, new_search=self.new_search)
+        self.new_search = False
+
+    def _record_search(self, results):
+        # For wrappers: their engines index the results, the wrapper records
+        # the search once under the engine that was asked for
+        if self.new_search:
+            LOCAL_INDEX.record_search(self.original_query, self.requested_name(), self.size, len(results))
+        self.new_search = False
+
+    def requested_name(self):
+        return self.name
+
+    def _observe(self, start, results):
+        elapsed = time.monotonic() - start
+        LATENCY.observe(self.name, elapsed)
+        ENGINE_REQUESTS.inc(self.name)
+        ENGINE_LATENCY.observe(elapsed, self.name)
+        ENGINE_RESULTS.inc(self.name, amount=len(results))
+
+    def _probe_and_filter(self, results):
+        """Fill in width/height, then keep only results meeting self.size."""
+        for _ in range(MAX_FILTERED_PAGES):
+            if not results:
+                return []
+            yield io(fill_dimensions, fill_dimensions_async, results, self.headers)
+            kept = [r for r in results if meets_size(r, self.size)]
+            SIZE_FILTERED.inc(self.name, amount=len(results) - len(kept))
+            if kept:
+                return kept
+            # Whole page was too small; an empty return would end the session
+            results = yield io(self._fetch_more, self._fetch_more_async)
+        return []
+
+    def _record_status(self, res):
+        """Count upstream HTTP failures for this engine."""
+        if res.status_code == 429:
+            UPSTREAM_429.inc(self.name)
+        elif res.status_code >= 400:
+            ENGINE_ERRORS.inc(self.name)
+
+    def _shared_fetch(self, position, page):
+        """Run the page flow once for all concurrent fetches of the same page."""
+        return FLIGHTS.do((self.name, self.query, self.size, position), lambda: run(page()))
+
+    async def _shared_fetch_async(self, position, page):
+        return await FLIGHTS.do_async((self.name, self.query, self.size, position), lambda: run_async(page()))
+
+    def _shared_page(self, position):
+        """io step fetching the page at position through FLIGHTS."""
+        return io(self._shared_fetch, self._shared_fetch_async, position, self._page)
+
+    def get_state(self):
+        """Resumable position of this search (see engine_from_state)."""
+        state = {'e': self.name, 'q': self.original_query, 's': self.size}
+        if self.probe and self.size not in MIN_RESOLUTION:
+            state['p'] = 1
+        for field in self.state_fields:
+            state[field] = getattr(self, field)
+        return state
+
+    def set_state(self, state):
+        for field in self.state_fields:
+            if field in state:
+                setattr(self, field, state[field])
 
     def _fetch_more(self):
+        return run(self._more())
+
+    async def _fetch_more_async(self):
+        return await run_async(self._more())
+
+    def _more(self):
+        """Flow returning the next page of results and advancing the position."""
         raise NotImplementedError
 
+    def _get(self, url, params=None):
+        return requests.get(url, params=params, headers=self.headers, timeout=10)
+
+    async def _get_async(self, url, params=None):
+        import aio_http
+        return await aio_http.get(url, params=params, headers=self.headers, timeout=10)
+
+    # Engines that fetch one plain GET per page describe the request with
+    # _page_request() and parse it with _parse_page(res); _page() does the rest.
+
+    def _page_request(self):
+        """(url, params) for the page at the current position."""
+        raise NotImplementedError
+
+    def _parse_page(self, res):
+        raise NotImplementedError
+
+    async def _parse_page_async(self, res):
+        return self._parse_page(res)
+
+    def _page(self):
+        """Flow fetching and parsing the page at the current position (no state change)."""
+        url, params = self._page_request()
+        try:
+            res = yield io(self._get, self._get_async, url, params)
+            self._record_status(res)
+            return (yield io(self._parse_page, self._parse_page_async, res))
+        except Exception as e:
+            ENGINE_ERRORS.inc(self.name)
+            print(f"{self.name} Error: {e}")
+            return []
+
 class BingImageSearch(SearchEngine):
+    name = 'bing'
+
     def __init__(self, query, size=None):
         super().__init__(query, size)
         self.offset = 1 
         self.headers['Accept'] = '*/*'
 
-    def _fetch_more(self):
+    def _more(self):
         if self.offset > 1000: return []
         
+        results = yield self._shared_page(self.offset)
+        self.offset += len(results)
+        return results
+
+    def _page_request(self):
         # Bing safe search OFF -> adlt=off
-        url = "https://www.bing.com/images/search"
         params = {
             'q': self.query,
             'first': self.offset,
@@ -54,60 +373,48 @@ class BingImageSearch(SearchEngine):
             'adlt': 'off', # OFF safe search
             'form': 'HDRSC2'
         }
-        
-        try:
-            resp = requests.get(url, params=params, headers=self.headers, timeout=10)
-            
-            # Bing often gives "murl" (Main URL) and "turl" (Thumbnail URL)
-            links = re.findall(r'murl&quot;:&quot;([^&]+)&quot;', resp.text)
-            if not links:
-                 links = re.findall(r'"murl":"([^"]+)"', resp.text)
-            
-            # Thumbnails: turl
-            thumbs = re.findall(r'turl&quot;:&quot;([^&]+)&quot;', resp.text)
-            if not thumbs:
-                thumbs = re.findall(r'"turl":"([^"]+)"', resp.text)
-            
-            formatted_results = []
-            for i, link in enumerate(links):
-                # Clean URL
-                full_url = unquote(link)
-                # Ensure thumbnail is available
-                thumb_url = unquote(thumbs[i]) if i < len(thumbs) else full_url
-
-                formatted_results.append({
-                    'image': full_url,
-                    'thumbnail': thumb_url, 
-                    'title': 'Bing Image',
-                    'source': 'Bing',
-                })
-            
-            if not formatted_results: return []
-            self.offset += len(formatted_results)
-            return formatted_results
-        except Exception as e:
-            print(f"Bing Error: {e}")
-            return []
+        return BING_URL, params
+
+    def _parse_page(self, res):
+        # Raw bytes, parsed off the request thread when PARSE_POOL has workers
+        return PARSE_POOL.run(parse_bing, res.content)
+
+    async def _parse_page_async(self, res):
+        return await PARSE_POOL.run_async(parse_bing, res.content)
 
 class DuckDuckGoSearch(SearchEngine):
+    name = 'ddg'
+    state_fields = ('offset', 'vqd', 'next_page')
+
     def __init__(self, query, size=None):
         super().__init__(query, size)
         self.headers['Referer'] = 'https://duckduckgo.com/'
+        self.vqd = None
+        self.next_page = None # DDG's own cursor ("i.js?...&s=100")
 
-    def _fetch_more(self):
-        if self.offset > 0: return []
+    def _more(self):
+        if self.offset > 0 and not self.next_page: return []
         
-        try:
-            # Force SAFE SEARCH OFF: kp=-2
-            res = requests.get('https://duckduckgo.com/', params={'q': self.query, 'kp': '-2'}, headers=self.headers)
-            
-            vqd = None
-            m = re.search(r'vqd=[\'"]([^\'"]+)[\'"]', res.text)
-            if m: vqd = m.group(1)
-            
-            if not vqd: return []
-            
-            url = "https://duckduckgo.com/i.js"
+        # vqd and the next token travel with the page so waiters can advance too
+        results, self.vqd, self.next_page = yield self._shared_page(self.next_page)
+        self.offset += 1
+        return results
+
+    def _vqd_request(self):
+        # Force SAFE SEARCH OFF: kp=-2
+        return DDG_URL, {'q': self.query, 'kp': '-2'}
+
+    def _parse_vqd(self, res):
+        self._record_status(res)
+        m = re.search(r'vqd=[\'"]([^\'"]+)[\'"]', res.text)
+        return m.group(1) if m else None
+
+    def _images_request(self, vqd):
+        if self.next_page:
+            url = DDG_URL + self.next_page
+            params = {'vqd': vqd, 'kp': '-2'}
+        else:
+            url = DDG_IMAGES_URL
             params = {
                 'l': 'us-en',
                 'o': 'json',
@@ -117,109 +424,398 @@ class DuckDuckGoSearch(SearchEngine):
                 'p': '1',
                 'kp': '-2' # OFF
             }
-            self.headers['Referer'] = 'https://duckduckgo.com/'
-            res = requests.get(url, params=params, headers=self.headers)
-            
-            if res.status_code == 403: return []
-                
-            data = res.json()
-            results = data.get('results', [])
+        self.headers['Referer'] = 'https://duckduckgo.com/'
+        return url, params
+
+    def _parse_images(self, res, vqd):
+        self._record_status(res)
+        
+        if res.status_code == 403: return [], vqd, None
             
-            formatted = []
-            for r in results:
-                formatted.append({
-                    'image': r.get('image'),
-                    'thumbnail': r.get('thumbnail'),
-                    'title': r.get('title', 'DDG Image'),
-                    'source': 'DuckDuckGo'
-                })
+        data = res.json()
+        results = data.get('results', [])
+        
+        formatted = []
+        for r in results:
+            formatted.append(Result(
+                r.get('image'), r.get('thumbnail'), r.get('title', 'DDG Image'), 'DuckDuckGo', r.get('url'),
+                r.get('width', 0), r.get('height', 0)
+            ))
+        
+        return formatted, vqd, (data.get('next') if formatted else None)
+
+    def _page(self):
+        vqd = self.vqd
+        try:
+            if not vqd:
+                url, params = self._vqd_request()
+                vqd = self._parse_vqd((yield io(self._get, self._get_async, url, params)))
+                if not vqd: return [], None, None
             
-            self.offset = 1
-            return formatted
+            url, params = self._images_request(vqd)
+            return self._parse_images((yield io(self._get, self._get_async, url, params)), vqd)
         except Exception as e:
+            ENGINE_ERRORS.inc(self.name)
             print(f"DDG Error: {e}")
-            return []
+            return [], vqd, None
 
 
 from api_client import CLIENT
+from tag_index import TAG_INDEX
+
+def format_posts(data):
+    """Rule34 API posts -> Results (shared with the watch-list). Feeds the tag index."""
+    TAG_INDEX.observe_posts(data)
+    formatted = []
+    for item in data:
+        # API returns fields: file_url, preview_url, score, etc.
+        # Handle potential missing fields
+        if 'file_url' not in item: continue
+        
+        # API URL might be http, upgrading to https
+        full_url = item.get('file_url', '').replace('http:', 'https:')
+        thumb_url = item.get('preview_url', '').replace('http:', 'https:')
+        
+        # If thumb is missing, use full (dangerous for bandwidth but better than nothing)
+        if not thumb_url: thumb_url = full_url
+        
+        # API gives direct links, so url is the file itself
+        formatted.append(Result(
+            full_url, thumb_url, f"Score: {item.get('score', 0)}", 'Rule34', full_url,
+            item.get('width', 0), item.get('height', 0),
+            id=item.get('id'), score=item.get('score', 0), tags=item.get('tags', '')
+        ))
+    return formatted
 
 class Rule34Search(SearchEngine):
+    name = 'rule34'
+    state_fields = ('page',)
+
     def __init__(self, query, size=None):
         super().__init__(query, size)
         self.query = query # Tags
         self.page = 0
+        # Checked on the first fetch, which runs off the caller's thread
+        self.invalid_tags = None
 
-    def _fetch_more(self):
-        # Use the rate-limited client
-        data = CLIENT.search(self.query, page=self.page)
+    def _more(self):
+        if self.invalid_tags is None:
+            # Known-bad tags would only cost a rate-limited request for nothing
+            self.invalid_tags = yield from TAG_INDEX.check_query(self.query)
+            if self.invalid_tags:
+                TAGS_REJECTED.inc()
+                print(f"[Rule34] Unknown tags, not querying: {' '.join(self.invalid_tags)}")
+        if self.invalid_tags: return []
         
-        formatted = []
-        for item in data:
-            # API returns fields: file_url, preview_url, score, etc.
-            # Handle potential missing fields
-            if 'file_url' not in item: continue
-            
-            # API URL might be http, upgrading to https
-            full_url = item.get('file_url', '').replace('http:', 'https:')
-            thumb_url = item.get('preview_url', '').replace('http:', 'https:')
-            
-            # If thumb is missing, use full (dangerous for bandwidth but better than nothing)
-            if not thumb_url: thumb_url = full_url
-            
-            formatted.append({
-                'image': full_url,
-                'thumbnail': thumb_url,
-                'title': f"Score: {item.get('score', 0)}",
-                'source': 'Rule34',
-                'url': full_url, # Direct link
-                'is_resolvable': False # API gives direct links!
-            })
-            
-        if formatted:
+        results = yield self._shared_page(self.page)
+        if results:
             self.page += 1
-            
-        return formatted
+        return results
 
+    def _page(self):
+        # Use the rate-limited client
+        data = yield io(CLIENT.search, CLIENT.search_async, self.query, self.page)
+        return format_posts(data)
 
 class YandexSearch(SearchEngine):
+    name = 'yandex'
+    state_fields = ('page',)
+
     def __init__(self, query, size=None):
         super().__init__(query, size)
         self.page = 0
         # Mobile UA sometimes gets easier HTML or different handling
         self.headers['User-Agent'] = "Mozilla/5.0 (Linux; Android 10; SM-G960U) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Mobile Safari/537.36"
 
-    def _fetch_more(self):
+    def _more(self):
         if self.page > 0: return []
         
-        url = f"https://yandex.com/images/search"
+        results = yield self._shared_page(self.page)
+        self.page = 1
+        return results
+
+    def _page_request(self):
         # Force safe search off? Yandex is tricky. 
         # Adding 'family=no' is a common param for some engines, worth a try.
-        params = {'text': self.query, 'family': 'no'} 
-        try:
-             res = requests.get(url, params=params, headers=self.headers, timeout=10)
-             # Regex update for mobile or desktop
-             # Looking for img_href or similar in JSON data blobs
-             matches = re.findall(r'"hh?tps?://[^"]+"', res.text)
-             images = [m.strip('"') for m in matches if any(x in m for x in ['.jpg', '.png', '.jpeg']) and 'avatars.mds.yandex.net' not in m]
-             images = list(set(images))
-             
-             formatted = []
-             for img in images[:40]:
-                  formatted.append({
-                      'image': img,
-                      'thumbnail': img, # Yandex scrape doesn't give separate thumb easily yet
-                      'title': 'Yandex Result',
-                      'source': 'Yandex',
-                      'url': img
-                  })
-                  
-             self.page = 1
-             return formatted
-        except Exception as e:
-            return []
+        return YANDEX_URL, {'text': self.query, 'family': 'no'}
+
+    def _parse_page(self, res):
+        return PARSE_POOL.run(parse_yandex, res.content)
+
+    async def _parse_page_async(self, res):
+        return await PARSE_POOL.run_async(parse_yandex, res.content)
+
+class HedgedSearch(SearchEngine):
+    """
+    Runs the primary engine and, if it is slower than its learned latency
+    percentile, races a backup engine for the same query. The first engine
+    to return results wins and serves the rest of the session.
+    """
+    name = 'hedged'
+
+    def __init__(self, engines, percentile=0.95):
+        super().__init__(engines[0].original_query, engines[0].size)
+        self.probe = False # Each engine probes and indexes its own results
+        self.index_results = False
+        self.engines = engines
+        self.percentile = percentile
+        self.active = 0
+        self.running = {} # engine index -> future still in flight
+
+    def _index(self, results):
+        self._record_search(results)
+
+    def requested_name(self):
+        return self.engines[0].name
+
+    def get_state(self):
+        # Resume on whichever engine won; 'h' re-enables hedging
+        return dict(self.engines[self.active].get_state(), h=1)
+
+    def set_state(self, state):
+        self.engines[0].set_state(state)
+
+    def _launch(self, idx):
+        fut = HEDGE_EXECUTOR.submit(self.engines[idx].fetch_next_batch)
+        self.running[idx] = fut
+        return fut
+
+    async def _launch_async(self, idx):
+        task = asyncio.ensure_future(self.engines[idx].fetch_next_batch_async())
+        self.running[idx] = task
+        return task
+
+    def _next_backup(self):
+        for idx in range(self.active + 1, len(self.engines)):
+            if idx not in self.running or self.running[idx].done():
+                return idx
+        return None
+
+    def _hedge(self, primary, reason, pending):
+        backup = self._next_backup()
+        if backup is not None and HEDGE_BUDGET.try_spend():
+            HEDGES.inc('launched')
+            print(f"[Hedge] {primary.name} {reason}, racing {self.engines[backup].name}")
+            pending[(yield io(self._launch, self._launch_async, backup))] = backup
+
+    def _winner(self, primary, done, pending):
+        """Results of the first finished engine that found any, else None."""
+        for fut in done:
+            idx = pending.pop(fut)
+            results = fut.result()
+            if results:
+                if idx != self.active:
+                    HEDGES.inc('won')
+                    print(f"[Hedge] {self.engines[idx].name} won over {primary.name}")
+                    self.active = idx
+                # Losers' results would be dropped anyway; stop them where possible
+                for loser in pending:
+                    HEDGES.inc('abandoned')
+                    HEDGE_BUDGET.abandon(loser)
+                return results
+        return None
+
+    def _wait(self, pending, timeout=None):
+        """io step: (done, not done) once one of pending finishes or timeout passes."""
+        # Thread futures and asyncio tasks have waits with the same signature
+        return io(wait, asyncio.wait, list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+
+    def _more(self):
+        primary = self.engines[self.active]
+        HEDGE_BUDGET.record_request()
+        pending = {(yield io(self._launch, self._launch_async, self.active)): self.active}
+        
+        delay = LATENCY.percentile(primary.name, self.percentile)
+        done, _ = yield self._wait(pending, delay)
+        hedged = False
+        while True:
+            results = self._winner(primary, done, pending)
+            if results:
+                return results
+            if not hedged:
+                # Hedge a slow primary, and one that already came back empty or failed
+                hedged = True
+                reason = f"slower than {delay:.2f}s" if pending else "returned nothing"
+                yield from self._hedge(primary, reason, pending)
+            if not pending:
+                return []
+            done, _ = yield self._wait(pending)
+
+class RankedSearch(SearchEngine):
+    """
+    Re-orders an engine's results by quality over a sliding window of pages.
+    The first batch waits for `window` pages; after that each batch fetches
+    one more page and emits a page's worth of the best buffered results, so
+    the buffer stays at about `window` pages and the best come out first.
+    """
+    name = 'ranked'
+
+    # Added to the quality of every result from that source
+    SOURCE_WEIGHTS = {'Rule34': 1.0, 'Bing': 1.0, 'DuckDuckGo': 1.0, 'Yandex': 0.5}
+    DUPLICATE_WEIGHT = 1.5 # Per doubling of times seen within the window
+    # Extra pages read when a batch comes out empty because everything was
+    # already emitted; an upstream repeating itself longer counts as ended
+    MAX_STALE_PAGES = 5
+
+    def __init__(self, engine, window=5, carry=True):
+        super().__init__(engine.original_query, engine.size)
+        self.probe = False # The wrapped engine probes and indexes its own results
+        self.index_results = False
+        self.engine = engine
+        self.window = max(1, window)
+        # False ranks each window on its own and returns it whole, so nothing
+        # is buffered between batches (cursor paging can't carry a buffer)
+        self.carry = carry
+        self.heap = []       # (-quality, seq, image); stale entries are skipped
+        self.candidates = {} # image -> [result, times seen, seq of live heap entry]
+        self.emitted = set()
+        self.seq = 0
+        self.page_size = 0
+        self.filled = False
+        self.exhausted = False
+
+    def _index(self, results):
+        self._record_search(results)
+
+    def requested_name(self):
+        return self.engine.requested_name()
+
+    def get_state(self):
+        return dict(self.engine.get_state(), r=self.window)
+
+    def set_state(self, state):
+        self.engine.set_state(state)
+
+    def quality(self, result, seen):
+        q = self.SOURCE_WEIGHTS.get(result.source, 1.0)
+        if result.score:
+            q += math.log1p(max(result.score, 0))
+        if result.width and result.height:
+            # 0 at one megapixel; unknown sizes stay neutral
+            q += max(-2.0, math.log2(result.width * result.height / 1e6))
+        return q + self.DUPLICATE_WEIGHT * math.log2(seen)
+
+    def _add(self, page):
+        """Buffer a page. Returns False (and marks the end) for an empty one."""
+        if not page:
+            self.exhausted = True
+            return False
+        self.page_size = len(page)
+        for r in page:
+            if not r.image or r.image in self.emitted:
+                continue
+            entry = self.candidates.get(r.image)
+            if entry is None:
+                entry = self.candidates[r.image] = [r, 0, 0]
+            entry[1] += 1
+            self.seq += 1
+            entry[2] = self.seq
+            heapq.heappush(self.heap, (-self.quality(entry[0], entry[1]), self.seq, r.image))
+        return True
+
+    def _pop(self, n):
+        out = []
+        while self.heap and len(out) < n:
+            _, seq, image = heapq.heappop(self.heap)
+            entry = self.candidates.get(image)
+            if entry is None or entry[2] != seq:
+                continue
+            del self.candidates[image]
+            self.emitted.add(image)
+            out.append(entry[0])
+        return out
+
+    def _pages_wanted(self):
+        if self.exhausted:
+            return 0
+        return 1 if self.carry and self.filled else self.window
+
+    def _batch(self):
+        self.filled = True
+        if not self.carry:
+            return self._pop(len(self.candidates))
+        return self._pop(self.page_size)
+
+    def _stale(self, batch, extra_pages):
+        """True while an empty batch should read one more page."""
+        if batch or self.exhausted:
+            return False
+        if extra_pages >= self.MAX_STALE_PAGES:
+            self.exhausted = True
+            return False
+        return True
+
+    def _more(self):
+        next_page = io(self.engine.fetch_next_batch, self.engine.fetch_next_batch_async)
+        for _ in range(self._pages_wanted()):
+            if not self._add((yield next_page)):
+                break
+        batch = self._batch()
+        # Pages of only already emitted images are not the end of the results
+        extra_pages = 0
+        while self._stale(batch, extra_pages):
+            extra_pages += 1
+            self._add((yield next_page))
+            batch = self._batch()
+        return batch
+
+class LocalSearch(SearchEngine):
+    """Pages through previously seen results in the local index (no network)."""
+    name = 'local'
+
+    def __init__(self, query, size=None):
+        super().__init__(query, size)
+        self.query = query
+        self.probe = False
+        self.index_results = False
+
+    def _fetch_more(self):
+        results = LOCAL_INDEX.search(self.query, limit=50, offset=self.offset)
+        self.offset += len(results)
+        return [r for r in results if meets_size(r, self.size)]
+
+    async def _fetch_more_async(self):
+        # SQLite reads block; keep them off the event loop
+        return await asyncio.to_thread(self._fetch_more)
+
+# Backup engines raced against a slow primary (same kind of content only)
+HEDGE_BACKUPS = {
+    'bing': ['ddg'],
+    'ddg': ['bing'],
+    'yandex': ['bing'],
+}
+
+# Largest ranking window (pages buffered per session)
+MAX_RANK_WINDOW = 20
+
+def get_engine(name, query, size=None, hedge=False, probe=False, rank=0, new_search=False, paging='session'):
+    """
+    probe=True fills in dimensions even when no size filter is requested.
+    rank=N serves results best-first over a sliding window of N pages.
+    new_search=True records the search in the history (not for resumed ones).
+    paging='cursor' for engines whose position travels in a cursor.
+    """
+    if rank:
+        engine = get_engine(name, query, size, hedge=hedge, probe=probe)
+        # A cursor can't hold the ranking buffer; each page is one ranked window
+        engine = RankedSearch(engine, window=min(rank, MAX_RANK_WINDOW), carry=paging != 'cursor')
+    elif hedge and name in HEDGE_BACKUPS:
+        engines = [get_engine(n, query, size, probe=probe) for n in [name] + HEDGE_BACKUPS[name]]
+        engine = HedgedSearch(engines)
+    elif name == 'local':
+        engine = LocalSearch(query, size)
+    else:
+        if name == 'ddg': engine = DuckDuckGoSearch(query, size)
+        elif name == 'rule34': engine = Rule34Search(query, size)
+        elif name == 'yandex': engine = YandexSearch(query, size)
+        else: engine = BingImageSearch(query, size)
+        engine.probe = engine.probe or probe
+    engine.new_search = new_search
+    return engine
 
-def get_engine(name, query, size=None):
-    if name == 'ddg': return DuckDuckGoSearch(query, size)
-    if name == 'rule34': return Rule34Search(query, size)
-    if name == 'yandex': return YandexSearch(query, size)
-    return BingImageSearch(query, size)
+def engine_from_state(state):
+    """Rebuild an engine from get_state() output, positioned to continue."""
+    engine = get_engine(state['e'], state['q'], state.get('s'), hedge=bool(state.get('h')),
+                        probe=bool(state.get('p')), rank=state.get('r', 0), paging='cursor')
+    engine.set_state(state)
+    return engine
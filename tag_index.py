@@ -0,0 +1,292 @@
+"""
+Local Rule34 tag index for autocomplete and query validation.
+
+Tags come from two places: every post the API returns (format_posts feeds
+them in as they pass) and a slow background sync of the site's tag list,
+stored in the local index database so it survives restarts. Lookups run
+against an immutable snapshot, a sorted name list plus an array of post
+counts: a prefix is two bisects, and the best matches are picked by count.
+The saved tags are loaded and the snapshot built in the background; until
+then lookups find nothing and no query is rejected.
+
+Once a full tag-list sync has finished, a tag missing from the index is
+looked up upstream by name (one cheap request for all of a query's missing
+tags, since the site gains tags between syncs). Only tags that are missing
+there too are rejected, which saves the search request they would spend.
+"""
+import time
+import heapq
+import bisect
+import sqlite3
+import threading
+from array import array
+from api_client import CLIENT
+from local_index import LOCAL_INDEX
+from metrics import TAG_SYNC_PAGES
+from flows import io, run, run_async
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tag_counts (
+    name TEXT PRIMARY KEY,
+    count INTEGER
+);
+CREATE TABLE IF NOT EXISTS tag_sync (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    next_page INTEGER,
+    complete INTEGER,
+    finished_at REAL
+);
+"""
+
+SYNC_PAGE_LIMIT = 1000
+SCAN_LIMIT = 256 # Prefix ranges larger than this cache their top matches
+QUERY_SYNTAX = {'(', ')', '{', '}', '~'}
+
+
+class TagIndex:
+    def __init__(self, path=None, rebuild_interval=5.0, sync_gap=5.0, resync_interval=86400, recheck_interval=600):
+        self.path = path # Defaults to the local index database
+        self.rebuild_interval = rebuild_interval
+        # Seconds between tag-list pages; keeps the sync to a small share of
+        # the 1 req/s Rule34 budget
+        self.sync_gap = sync_gap
+        self.resync_interval = resync_interval
+        # Seconds a tag confirmed missing upstream stays rejected without a new lookup
+        self.recheck_interval = recheck_interval
+        self.lock = threading.Lock()
+        self.synced = {} # name -> site-wide post count
+        self.seen = {}   # name -> times seen on fetched posts (tags not synced yet)
+        self.missing = {} # name -> monotonic time it was confirmed missing upstream
+        self.next_page = 0
+        self.complete = False
+        self.loaded = False
+        self.load_thread = None
+        self.loaded_event = threading.Event()
+        self.dirty = False
+        self.snapshot = None # (sorted names, counts, top-k cache)
+        self.built_at = 0
+        self.rebuilding = False
+        self.sync_thread = None
+
+    # --- Storage ---
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path or LOCAL_INDEX.path, timeout=10)
+        conn.executescript(SCHEMA)
+        return conn
+
+    def _ensure_loading(self):
+        """True once loaded; otherwise starts loading in the background."""
+        if self.loaded:
+            return True
+        with self.lock:
+            if self.load_thread is None:
+                self.load_thread = threading.Thread(target=self._load, name='tag-load', daemon=True)
+                self.load_thread.start()
+        return False
+
+    def wait_loaded(self, timeout=None):
+        self._ensure_loading()
+        return self.loaded_event.wait(timeout)
+
+    def _load(self):
+        # Reads every saved tag and scans the results table: far too slow for
+        # a request, event loop or UI thread
+        synced, seen, row = {}, {}, None
+        try:
+            conn = self._connect()
+            try:
+                synced = dict(conn.execute('SELECT name, count FROM tag_counts'))
+                row = conn.execute('SELECT next_page, complete FROM tag_sync WHERE id = 1').fetchone()
+                try:
+                    # Tags of posts already in the local index
+                    for (tags,) in conn.execute("SELECT tags FROM results WHERE source = 'Rule34' AND tags != ''"):
+                        for tag in tags.split():
+                            if tag not in synced:
+                                seen[tag] = seen.get(tag, 0) + 1
+                except sqlite3.OperationalError:
+                    pass # Local index not created yet
+            finally:
+                conn.close()
+        except Exception as e:
+            # An empty index never rejects a query
+            print(f"[Tags] Could not load the tag index: {e}")
+        with self.lock:
+            # Keep what observe_posts() counted meanwhile
+            for tag, n in self.seen.items():
+                if tag not in synced:
+                    seen[tag] = seen.get(tag, 0) + n
+            self.synced, self.seen = synced, seen
+            if row:
+                self.next_page, self.complete = row[0], bool(row[1])
+        self._build()
+        self.loaded = True
+        self.loaded_event.set()
+
+    # --- Updates ---
+
+    def observe_posts(self, posts):
+        """Count the tags of API posts (called for every fetched page)."""
+        self._ensure_loading()
+        with self.lock:
+            for item in posts:
+                for tag in (item.get('tags') or '').split():
+                    if tag not in self.synced:
+                        self.seen[tag] = self.seen.get(tag, 0) + 1
+                        self.dirty = True
+
+    def sync_page(self):
+        """
+        Fetch the next page of the site's tag list. Returns True once a pass
+        ends on a short page; a failed page changes nothing.
+        """
+        self.wait_loaded()
+        page = self.next_page
+        tags = CLIENT.tags(page=page, limit=SYNC_PAGE_LIMIT)
+        TAG_SYNC_PAGES.inc()
+        if tags is None:
+            # Not an empty page: the position and completeness stay as they were
+            print(f"[Tags] Tag-list page {page} failed; retrying later")
+            return False
+        finished = len(tags) < SYNC_PAGE_LIMIT
+        with self.lock:
+            for t in tags:
+                self.synced[t['name']] = t['count']
+                self.seen.pop(t['name'], None)
+            self.next_page = 0 if finished else page + 1
+            if finished:
+                self.complete = True
+            self.dirty = True
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany('INSERT OR REPLACE INTO tag_counts (name, count) VALUES (?, ?)',
+                                 [(t['name'], t['count']) for t in tags])
+                conn.execute('INSERT OR REPLACE INTO tag_sync (id, next_page, complete, finished_at) VALUES (1, ?, ?, ?)',
+                             (self.next_page, int(self.complete), time.time() if finished else None))
+        finally:
+            conn.close()
+        if finished:
+            print(f"[Tags] Tag-list sync finished: {len(self.synced)} tags")
+        return finished
+
+    def _sync_loop(self):
+        while True:
+            try:
+                finished = self.sync_page()
+            except Exception as e:
+                print(f"[Tags] Sync failed: {e}")
+                finished = False
+            time.sleep(self.resync_interval if finished else self.sync_gap)
+
+    def start_sync(self):
+        with self.lock:
+            if self.sync_thread is None:
+                self.sync_thread = threading.Thread(target=self._sync_loop, name='tag-sync', daemon=True)
+                self.sync_thread.start()
+
+    # --- Snapshot ---
+
+    def _build(self):
+        with self.lock:
+            counts = dict(self.seen)
+            counts.update(self.synced)
+            self.dirty = False
+        names = sorted(counts)
+        self.snapshot = (names, array('q', (counts[n] for n in names)), {})
+        self.built_at = time.monotonic()
+        self.rebuilding = False
+
+    def _current(self):
+        """The lookup snapshot, or None while the index is still loading."""
+        if not self._ensure_loading():
+            return None
+        if self.dirty and not self.rebuilding and time.monotonic() - self.built_at >= self.rebuild_interval:
+            # Lookups keep using the old snapshot meanwhile
+            self.rebuilding = True
+            threading.Thread(target=self._build, name='tag-rebuild', daemon=True).start()
+        return self.snapshot
+
+    # --- Lookups ---
+
+    def complete_prefix(self, prefix, limit=10):
+        """Most used tags starting with prefix: [(name, count), ...]."""
+        prefix = prefix.strip().lower()
+        snapshot = self._current()
+        if not prefix or snapshot is None:
+            return []
+        names, counts, cache = snapshot
+        lo = bisect.bisect_left(names, prefix)
+        hi = bisect.bisect_left(names, prefix + '\U0010ffff', lo)
+        if hi - lo > SCAN_LIMIT:
+            key = (prefix, limit)
+            if key not in cache:
+                cache[key] = heapq.nlargest(limit, range(lo, hi), key=counts.__getitem__)
+            top = cache[key]
+        else:
+            top = heapq.nlargest(limit, range(lo, hi), key=counts.__getitem__)
+        return [(names[i], counts[i]) for i in top]
+
+    def suggest(self, tag, limit=5):
+        """Known tags sharing the longest possible prefix with a mistyped one."""
+        for n in range(len(tag), 0, -1):
+            matches = self.complete_prefix(tag[:n], limit)
+            if matches:
+                return [name for name, _ in matches]
+        return []
+
+    def exists(self, tag):
+        return tag in self.synced or tag in self.seen
+
+    def invalid_tags(self, query):
+        """
+        Tags in a Rule34 query that don't exist. Always empty until the index
+        is loaded and a full tag-list sync has finished, since unknown tags
+        can't be ruled out before.
+        """
+        return run(self.check_query(query))
+
+    async def invalid_tags_async(self, query):
+        return await run_async(self.check_query(query))
+
+    def check_query(self, query):
+        """invalid_tags() as a flow (see flows.py)."""
+        if not self._ensure_loading() or not self.complete:
+            return []
+        unknown = []
+        for token in query.lower().split():
+            tag = token.lstrip('-~')
+            # Meta tags (rating:, score:>, sort:, id:>) and wildcards aren't in the list
+            if not tag or tag in QUERY_SYNTAX or ':' in tag or '*' in tag:
+                continue
+            if not self.exists(tag) and tag not in unknown:
+                unknown.append(tag)
+        now = time.monotonic()
+        recheck = [tag for tag in unknown if now - self.missing.get(tag, -self.recheck_interval) >= self.recheck_interval]
+        if recheck:
+            # Tags created since the last sync must not be turned away
+            found = yield io(CLIENT.tags, CLIENT.tags_async, limit=len(recheck), names=recheck)
+            if found is None:
+                # Lookup failed: only reject what was confirmed missing before
+                return [tag for tag in unknown if tag not in recheck]
+            found = {t['name']: t['count'] for t in found}
+            with self.lock:
+                self.synced.update(found)
+                self.dirty = bool(found) or self.dirty
+                self.missing = {t: at for t, at in self.missing.items() if now - at < self.recheck_interval}
+                for tag in recheck:
+                    if tag not in found:
+                        self.missing[tag] = now
+        return [tag for tag in unknown if not self.exists(tag)]
+
+    def stats(self):
+        return {
+            'loaded': self.loaded,
+            'synced': len(self.synced),
+            'seen_only': len(self.seen),
+            'sync_complete': self.complete,
+            'sync_next_page': self.next_page,
+        }
+
+
+TAG_INDEX = TagIndex()
@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# The modules live flat in the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Set before anything imports cursors / local_index
+os.environ.setdefault('Q8_CURSOR_SECRET', 'test-secret')
+os.environ.setdefault('Q8_INDEX_PATH', os.path.join(tempfile.mkdtemp(prefix='q8-tests-'), 'local_index.db'))
@@ -0,0 +1,83 @@
+import pytest
+from bandwidth import BandwidthScheduler, Transfer, QueueTimeout
+
+
+def queue(scheduler, priority, owner='o', host='a.example'):
+    """Enqueue a transfer without blocking; check .granted afterwards."""
+    transfer = Transfer(scheduler, priority, owner, host)
+    scheduler._enqueue(transfer)
+    return transfer
+
+
+def test_higher_priority_is_served_first():
+    s = BandwidthScheduler(max_transfers=1)
+    busy = queue(s, 'bulk')
+    bulk = queue(s, 'bulk')
+    thumb = queue(s, 'thumbnail')
+    interactive = queue(s, 'interactive')
+    assert busy.granted and not (bulk.granted or thumb.granted or interactive.granted)
+
+    busy.release()
+    assert interactive.granted and not thumb.granted and not bulk.granted
+    interactive.release()
+    assert thumb.granted and not bulk.granted
+    thumb.release()
+    assert bulk.granted
+
+
+def test_owners_take_turns_within_a_priority():
+    s = BandwidthScheduler(max_transfers=1)
+    busy = queue(s, 'bulk', owner='big')
+    big = [queue(s, 'bulk', owner='big') for _ in range(3)]
+    small = queue(s, 'bulk', owner='small')
+
+    busy.release()
+    assert big[0].granted
+    big[0].release()
+    assert small.granted and not big[1].granted
+
+
+def test_per_host_limit_lets_other_hosts_through():
+    s = BandwidthScheduler(max_transfers=8, per_host=2)
+    a = [queue(s, 'interactive', host='a.example') for _ in range(3)]
+    b = queue(s, 'interactive', host='b.example')
+    assert [t.granted for t in a] == [True, True, False]
+    assert b.granted
+
+    a[0].release()
+    assert a[2].granted
+    assert s.snapshot()['hosts'] == {'a.example': 2, 'b.example': 1}
+
+
+def test_bulk_share_keeps_slots_for_interactive():
+    s = BandwidthScheduler(max_transfers=4, per_host=4, bulk_share=0.5)
+    bulk = [queue(s, 'bulk', host=f'h{i}.example') for i in range(3)]
+    assert [t.granted for t in bulk] == [True, True, False]
+    assert queue(s, 'interactive', host='x.example').granted
+
+
+def test_acquire_times_out_and_leaves_the_queue():
+    s = BandwidthScheduler(max_transfers=1)
+    holder = s.acquire('bulk', 'o', 'http://a.example/1.png')
+    with pytest.raises(QueueTimeout):
+        s.acquire('interactive', 'o', 'http://a.example/2.png', timeout=0.05)
+    assert s.snapshot()['queued']['interactive'] == {}
+    holder.release()
+    assert s.snapshot()['active'] == {'interactive': 0, 'thumbnail': 0, 'bulk': 0}
+
+
+def test_bulk_cannot_hold_every_connection_to_a_host():
+    s = BandwidthScheduler(max_transfers=16, per_host=4, bulk_share=0.75)
+    bulk = [queue(s, 'bulk', owner='zip') for _ in range(10)]
+    assert sum(t.granted for t in bulk) == 3
+    interactive = queue(s, 'interactive')
+    assert interactive.granted
+    waiting = queue(s, 'interactive')
+    assert not waiting.granted # Host is at per_host now
+
+    interactive.release()
+    assert waiting.granted and sum(t.granted for t in bulk) == 3
+    waiting.release()
+    assert sum(t.granted for t in bulk) == 3 # Still only bulk's share
+    bulk[0].release()
+    assert sum(t.granted for t in bulk) == 4
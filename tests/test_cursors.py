@@ -0,0 +1,35 @@
+import pytest
+import cursors
+from cursors import InvalidCursor
+
+
+def test_round_trip():
+    state = {'e': 'bing', 'q': 'cats', 'offset': 35, 's': None}
+    assert cursors.decode(cursors.encode(state)) == state
+
+
+def test_tampered_payload_is_rejected():
+    token = cursors.encode({'e': 'rule34', 'q': 'cats', 'page': 1})
+    body, sig = token.split('.')
+    forged = cursors._b64encode(b'{"e":"rule34","page":99,"q":"cats"}')
+    with pytest.raises(InvalidCursor, match='signature'):
+        cursors.decode(forged + '.' + sig)
+
+
+def test_tampered_signature_is_rejected():
+    token = cursors.encode({'e': 'bing', 'q': 'cats'})
+    body, sig = token.split('.')
+    flipped = ('A' if sig[0] != 'A' else 'B') + sig[1:]
+    with pytest.raises(InvalidCursor):
+        cursors.decode(body + '.' + flipped)
+
+
+@pytest.mark.parametrize('token', ['', 'no-dot', '!!!.???', 'e30.'])
+def test_malformed_tokens(token):
+    with pytest.raises(InvalidCursor):
+        cursors.decode(token)
+
+
+def test_signed_but_incomplete_state():
+    with pytest.raises(InvalidCursor, match='Incomplete'):
+        cursors.decode(cursors.encode({'q': 'cats'}))
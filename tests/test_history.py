@@ -0,0 +1,44 @@
+import pytest
+from results import Result
+from local_index import LOCAL_INDEX
+from search_logic import SearchEngine, RankedSearch
+
+
+class Pages(SearchEngine):
+    name = 'pages'
+
+    def __init__(self, query, pages):
+        super().__init__(query)
+        self.pages = list(pages)
+
+    def _fetch_more(self):
+        return self.pages.pop(0) if self.pages else []
+
+
+def history_for(query):
+    LOCAL_INDEX.flush()
+    return [(h['engine'], h['results']) for h in LOCAL_INDEX.history(limit=500) if h['query'] == query]
+
+
+@pytest.mark.parametrize('wrap', [False, True])
+def test_empty_first_page_is_recorded(wrap):
+    query = f'nothing here {wrap}'
+    engine = Pages(query, [])
+    if wrap:
+        engine = RankedSearch(engine, window=2)
+    engine.new_search = True
+    assert engine.fetch_next_batch() == []
+    assert history_for(query) == [('pages', 0)]
+
+
+def test_only_the_first_page_is_recorded():
+    engine = Pages('two pages', [[Result('http://img/a')], [Result('http://img/b')]])
+    engine.new_search = True
+    engine.fetch_next_batch()
+    engine.fetch_next_batch()
+    assert history_for('two pages') == [('pages', 1)]
+
+
+def test_resumed_searches_are_not_recorded():
+    Pages('resumed', [[Result('http://img/c')]]).fetch_next_batch()
+    assert history_for('resumed') == []
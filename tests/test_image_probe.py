@@ -0,0 +1,56 @@
+import struct
+import zlib
+from image_probe import parse_image_size
+
+
+def png(width, height):
+    ihdr = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    chunk = struct.pack('>I', len(ihdr)) + b'IHDR' + ihdr + struct.pack('>I', zlib.crc32(b'IHDR' + ihdr))
+    return b'\x89PNG\r\n\x1a\n' + chunk
+
+
+def jpeg(width, height, sof=0xC0):
+    app0 = b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\x00' + b'\x00' * 9
+    frame = struct.pack('>BHHB', 8, height, width, 3) + b'\x00' * 9
+    return b'\xff\xd8' + app0 + bytes([0xFF, sof]) + struct.pack('>H', len(frame) + 2) + frame
+
+
+def webp(chunk, payload):
+    body = b'WEBP' + chunk + struct.pack('<I', len(payload)) + payload
+    return b'RIFF' + struct.pack('<I', len(body)) + body
+
+
+def test_png():
+    assert parse_image_size(png(1920, 1080)) == (1920, 1080)
+
+
+def test_jpeg_baseline_after_app0():
+    assert parse_image_size(jpeg(3840, 2160)) == (3840, 2160)
+
+
+def test_jpeg_progressive():
+    assert parse_image_size(jpeg(640, 480, sof=0xC2)) == (640, 480)
+
+
+def test_webp_lossy():
+    # Frame tag, start code, then 14-bit width/height with scale bits on top
+    payload = b'\x00\x00\x00' + b'\x9d\x01\x2a' + struct.pack('<HH', 1280 | 0x4000, 720)
+    assert parse_image_size(webp(b'VP8 ', payload)) == (1280, 720)
+
+
+def test_webp_lossless():
+    w, h = 800, 600
+    bits = (w - 1) | ((h - 1) << 14)
+    payload = b'\x2f' + struct.pack('<I', bits) + b'\x00' * 8 # Start of the image data
+    assert parse_image_size(webp(b'VP8L', payload)) == (800, 600)
+
+
+def test_webp_extended():
+    payload = b'\x00' * 4 + (2560 - 1).to_bytes(3, 'little') + (1440 - 1).to_bytes(3, 'little')
+    assert parse_image_size(webp(b'VP8X', payload)) == (2560, 1440)
+
+
+def test_truncated_and_unknown():
+    assert parse_image_size(png(10, 10)[:20]) is None
+    assert parse_image_size(b'\xff\xd8\xff\xe0\x00') is None
+    assert parse_image_size(b'not an image at all') is None
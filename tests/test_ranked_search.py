@@ -0,0 +1,75 @@
+from results import Result
+from search_logic import SearchEngine, RankedSearch, get_engine, engine_from_state
+
+
+class Pages(SearchEngine):
+    """Engine serving fixed pages, then nothing."""
+    name = 'pages'
+
+    def __init__(self, pages):
+        super().__init__('q')
+        self.probe = False
+        self.index_results = False
+        self.pages = list(pages)
+
+    def _fetch_more(self):
+        return self.pages.pop(0) if self.pages else []
+
+
+def result(name, score=0, source='Rule34'):
+    return Result(f'http://img/{name}', source=source, score=score)
+
+
+def images(batch):
+    return [r.image.rsplit('/', 1)[1] for r in batch]
+
+
+def ranked(pages, **kwargs):
+    engine = RankedSearch(Pages(pages), **kwargs)
+    engine.index_results = False
+    return engine
+
+
+def test_first_batch_ranks_the_whole_window():
+    pages = [[result('a', 1), result('b', 50)], [result('c', 500), result('d', 5)]]
+    engine = ranked(pages, window=2)
+    assert images(engine.fetch_next_batch()) == ['c', 'b']
+    assert images(engine.fetch_next_batch()) == ['d', 'a']
+
+
+def test_duplicates_rank_higher_and_are_emitted_once():
+    pages = [[result('a', 10), result('b', 10)], [result('b', 10), result('c', 10)]]
+    engine = ranked(pages, window=2)
+    first = images(engine.fetch_next_batch())
+    assert first[0] == 'b'
+    rest = images(engine.fetch_next_batch())
+    assert sorted(first + rest) == ['a', 'b', 'c']
+
+
+def test_yandex_is_weighted_down():
+    pages = [[result('y', source='Yandex'), result('b', source='Bing')]]
+    engine = ranked(pages, window=1, carry=False)
+    assert images(engine.fetch_next_batch()) == ['b', 'y']
+
+
+def test_without_carry_each_window_is_returned_whole():
+    pages = [[result('a', 1)], [result('b', 2)], [result('c', 3)]]
+    engine = ranked(pages, window=2, carry=False)
+    assert images(engine.fetch_next_batch()) == ['b', 'a']
+    assert images(engine.fetch_next_batch()) == ['c']
+    assert engine.fetch_next_batch() == []
+
+
+def test_pages_of_already_emitted_images_are_skipped():
+    repeat = [result('a', 1)]
+    pages = [repeat, list(repeat), list(repeat), [result('new', 1)]]
+    engine = ranked(pages, window=1)
+    assert images(engine.fetch_next_batch()) == ['a']
+    assert images(engine.fetch_next_batch()) == ['new']
+
+
+def test_cursor_paging_never_carries_a_buffer():
+    assert get_engine('bing', 'cats', rank=3).carry
+    cursor_engine = get_engine('bing', 'cats', rank=3, paging='cursor')
+    assert not cursor_engine.carry
+    assert not engine_from_state(cursor_engine.get_state()).carry
@@ -0,0 +1,30 @@
+from results import Result
+import api_common
+
+
+def post():
+    return Result('http://img/1.png', thumbnail='http://img/1.png', source='Rule34',
+                  width=1920, height=1080, id=7, score=0, tags='cat dog')
+
+
+def test_rule34_metadata_is_opt_in():
+    assert post().to_json() == {'image': 'http://img/1.png', 'thumbnail': 'http://img/1.png',
+                                'source': 'Rule34', 'width': 1920, 'height': 1080}
+    rows = api_common.encode_results([post()], fields='score,tags')
+    assert rows[0]['score'] == 0 and rows[0]['tags'] == 'cat dog' and 'id' not in rows[0]
+
+
+def test_columnar_nulls_thumbnails_and_respects_fields():
+    cols = api_common.encode_results([post(), Result('http://img/2.png')], 'columnar')
+    assert cols['count'] == 2
+    assert 'thumbnail' not in cols['columns'] and 'tags' not in cols['columns']
+    cols = api_common.encode_results([post()], 'columnar', 'id,bogus')
+    assert cols['columns']['id'] == [7]
+
+
+def test_etag_only_for_cursor_pages():
+    assert api_common.wants_etag('search_images', {'paging': 'cursor'})
+    assert api_common.wants_etag('search_more', {'cursor': 'abc.def'})
+    assert not api_common.wants_etag('search_images', {'q': 'cats'})
+    assert not api_common.wants_etag('search_more', {'session_id': 'x'})
+    assert not api_common.wants_etag('metrics', {'paging': 'cursor'})
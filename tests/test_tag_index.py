@@ -0,0 +1,117 @@
+import pytest
+import tag_index
+from tag_index import TagIndex
+
+
+@pytest.fixture
+def index(tmp_path):
+    idx = TagIndex(path=str(tmp_path / 'tags.db'))
+    assert idx.wait_loaded(5)
+    idx.synced.update({'cat': 500, 'cat_ears': 900, 'catgirl': 300, 'dog': 50, 'cats': 10})
+    idx._build()
+    return idx
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Tags the site has beyond the index, and the names= lookups made."""
+    site = {'new_tag': 3}
+    lookups = []
+
+    def tags(page=0, limit=1000, names=None):
+        lookups.append(names)
+        return [{'name': n, 'count': site[n], 'id': 1} for n in names if n in site]
+
+    monkeypatch.setattr(tag_index.CLIENT, 'tags', tags)
+    return lookups
+
+
+def test_nothing_is_found_or_rejected_while_loading(tmp_path, monkeypatch):
+    idx = TagIndex(path=str(tmp_path / 'tags.db'))
+    monkeypatch.setattr(idx, '_load', lambda: None) # Never finishes
+    idx.complete = True
+    assert idx.complete_prefix('cat') == []
+    assert idx.invalid_tags('nosuchtag') == []
+    idx.observe_posts([{'tags': 'early'}])
+    assert idx.seen == {'early': 1}
+
+
+def test_tags_seen_while_loading_are_kept(tmp_path):
+    idx = TagIndex(path=str(tmp_path / 'tags.db'))
+    idx.load_thread = True # Hold off the background load
+    idx.observe_posts([{'tags': 'early'}])
+    idx._load()
+    assert idx.exists('early') and idx.complete_prefix('ea') == [('early', 1)]
+
+
+def test_prefix_lookup_orders_by_count(index):
+    assert index.complete_prefix('cat', limit=3) == [('cat_ears', 900), ('cat', 500), ('catgirl', 300)]
+    assert index.complete_prefix('  DO ') == [('dog', 50)]
+    assert index.complete_prefix('zzz') == []
+    assert index.complete_prefix('') == []
+
+
+def test_large_prefix_ranges_use_the_cache(index, monkeypatch):
+    monkeypatch.setattr(tag_index, 'SCAN_LIMIT', 1)
+    first = index.complete_prefix('cat', limit=2)
+    assert first == [('cat_ears', 900), ('cat', 500)]
+    assert ('cat', 2) in index.snapshot[2]
+    assert index.complete_prefix('cat', limit=2) == first
+
+
+def test_suggest_falls_back_to_shorter_prefixes(index):
+    assert index.suggest('catz', limit=2) == ['cat_ears', 'cat']
+
+
+def test_posts_add_seen_tags(index):
+    index.observe_posts([{'tags': 'new_tag cat'}])
+    assert index.exists('new_tag')
+    assert 'cat' not in index.seen
+
+
+def test_validation_waits_for_a_complete_sync(index, upstream):
+    assert index.invalid_tags('cat nosuchtag') == []
+    index.complete = True
+    assert index.invalid_tags('cat nosuchtag') == ['nosuchtag']
+
+
+def test_validation_skips_meta_tags_and_syntax(index, upstream):
+    index.complete = True
+    query = '-dog ~ cats rating:safe score:>10 cat* ( catgirl ) ~misspelt'
+    assert index.invalid_tags(query) == ['misspelt']
+    assert upstream == [['misspelt']]
+
+
+def test_tags_new_since_the_sync_are_looked_up(index, upstream):
+    index.complete = True
+    assert index.invalid_tags('cat new_tag typo') == ['typo']
+    assert upstream == [['new_tag', 'typo']]
+    # Found tags join the index; confirmed misses aren't looked up again for a while
+    assert index.invalid_tags('new_tag typo') == ['typo']
+    assert upstream == [['new_tag', 'typo']]
+    index.missing['typo'] -= index.recheck_interval
+    index.invalid_tags('typo')
+    assert upstream[-1] == ['typo']
+
+
+def test_failed_lookup_lets_the_query_through(index, monkeypatch):
+    index.complete = True
+    monkeypatch.setattr(tag_index.CLIENT, 'tags', lambda **kwargs: None)
+    assert index.invalid_tags('typo') == []
+
+
+def test_failed_sync_page_keeps_position(index, monkeypatch):
+    index.next_page = 3
+    monkeypatch.setattr(tag_index.CLIENT, 'tags', lambda page, limit: None)
+    assert index.sync_page() is False
+    assert index.next_page == 3 and not index.complete
+
+
+def test_short_sync_page_completes_and_persists(index, monkeypatch, tmp_path):
+    monkeypatch.setattr(tag_index.CLIENT, 'tags', lambda page, limit: [{'name': 'bird', 'count': 7}])
+    assert index.sync_page() is True
+    assert index.complete and index.next_page == 0
+
+    reloaded = TagIndex(path=index.path)
+    reloaded.wait_loaded(5)
+    assert reloaded.complete and reloaded.synced == {'bird': 7}
@@ -0,0 +1,68 @@
+import json
+import pytest
+import watchlist
+from watchlist import WatchList
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Posts the fake Rule34 API knows about; newest first like the site."""
+    posts = []
+
+    def search(tags, page=0, limit=20):
+        newer = 0
+        if 'id:>' in tags:
+            newer = int(tags.split('id:>')[1].split()[0])
+            return sorted((p for p in posts if p['id'] > newer), key=lambda p: p['id'])[:limit]
+        return sorted(posts, key=lambda p: -p['id'])[:limit]
+
+    monkeypatch.setattr(watchlist.CLIENT, 'search', search)
+    return posts
+
+
+def post(id):
+    return {'id': id, 'file_url': f'http://img/{id}.png', 'tags': 'cat'}
+
+
+def test_first_poll_only_sets_the_baseline(tmp_path, upstream):
+    wl = WatchList(path=str(tmp_path / 'w.json'))
+    wl.add('cat')
+    upstream.extend([post(1), post(2)])
+    assert wl.poll('cat') == []
+    upstream.append(post(3))
+    assert [i.id for i in wl.poll('cat')] == [3]
+
+
+def test_first_posts_of_an_empty_query_are_reported(tmp_path, upstream):
+    wl = WatchList(path=str(tmp_path / 'w.json'))
+    wl.add('cat')
+    assert wl.poll('cat') == []
+    upstream.extend([post(5), post(6)])
+    assert sorted(i.id for i in wl.poll('cat')) == [5, 6]
+
+
+def test_old_files_migrate_the_baseline(tmp_path, upstream):
+    path = tmp_path / 'w.json'
+    path.write_text(json.dumps({
+        'cat': {'max_id': 4, 'catching_up': False, 'last_poll': 0, 'new_total': 0, 'interval': 600},
+        'dog': {'max_id': 0, 'catching_up': False, 'last_poll': 0, 'new_total': 0, 'interval': 600},
+    }))
+    wl = WatchList(path=str(path))
+    assert {e['tags']: e['baselined'] for e in wl.list()} == {'cat': True, 'dog': False}
+
+
+def test_changes_saved_by_another_process_are_picked_up(tmp_path, upstream):
+    path = str(tmp_path / 'w.json')
+    poller, other = WatchList(path=path), WatchList(path=path)
+    other.add('cat')
+    assert [e['tags'] for e in poller.list()] == ['cat']
+    upstream.append(post(1))
+    poller.poll('cat')
+    other.remove('cat')
+    assert poller.list() == []
+
+
+def test_interval_validation(tmp_path):
+    wl = WatchList(path=str(tmp_path / 'w.json'))
+    with pytest.raises(ValueError):
+        wl.add('cat', interval=5)
@@ -0,0 +1,230 @@
+"""
+Incremental watch-list sync for saved Rule34 tag queries.
+
+Each saved query remembers the highest post ID it has seen. A single
+background scheduler polls the most overdue query with
+"<tags> id:>N sort:id:asc", so a poll only returns posts newer than the
+last one and is usually a single cheap request instead of a re-scan from
+pid=0. Polls are spaced so the watch-list uses at most a fraction of the
+shared 1 req/s Rule34 budget, and due queries are served oldest-first so
+none starves.
+
+Only one process polls (see app.start_background_workers); other worker
+processes just edit the saved queries, and every process re-reads the file
+when another one has changed it.
+"""
+import os
+import json
+import math
+import time
+import threading
+from collections import deque
+from api_client import CLIENT
+from search_logic import format_posts
+from local_index import LOCAL_INDEX
+from metrics import WATCH_POLLS, WATCH_NEW_ITEMS
+
+WATCHLIST_PATH = os.environ.get('Q8_WATCHLIST_PATH', os.path.join(os.getcwd(), 'watchlist.json'))
+
+PAGE_LIMIT = 100 # Posts per delta request (API maximum is 1000)
+RECENT_ITEMS = 100 # New items kept in memory per query for the API
+MIN_INTERVAL = 60 # Seconds; shorter polls would crowd out interactive searches
+REFRESH_INTERVAL = 30 # Seconds an idle poller waits before re-reading the file
+
+
+def parse_interval(value, default):
+    """Poll interval from user input; ValueError unless a number >= MIN_INTERVAL."""
+    if value is None or value == '':
+        return default
+    try:
+        if isinstance(value, bool):
+            raise TypeError
+        interval = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"interval must be a number of seconds, got {value!r}")
+    if not math.isfinite(interval) or interval < MIN_INTERVAL:
+        raise ValueError(f"interval must be at least {MIN_INTERVAL} seconds")
+    return interval
+
+
+class WatchList:
+    def __init__(self, path=WATCHLIST_PATH, poll_gap=2.5, default_interval=600, on_new_items=None):
+        self.path = path
+        # Minimum seconds between watch-list requests; 2.5s leaves over half
+        # of the 1.1s-spaced Rule34 slots to interactive searches
+        self.poll_gap = poll_gap
+        self.default_interval = default_interval
+        self.on_new_items = on_new_items # callback(tags, items) for auto-download
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.recent = {}
+        self.loaded_mtime = None
+        self.queries = self._load()
+
+    # --- Persistence ---
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            self.loaded_mtime = os.stat(self.path).st_mtime_ns
+            with open(self.path, 'r') as f:
+                queries = json.load(f)
+        except Exception as e:
+            print(f"[Watch] Could not load {self.path}: {e}")
+            return {}
+        for tags, entry in queries.items():
+            # Files from before the flag: a recorded ID means the baseline was taken
+            entry.setdefault('baselined', entry.get('max_id', 0) > 0)
+            try:
+                entry['interval'] = parse_interval(entry.get('interval'), self.default_interval)
+            except ValueError as e:
+                print(f"[Watch] {tags}: {e}; using {self.default_interval}s")
+                entry['interval'] = self.default_interval
+        return queries
+
+    def _save(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.queries, f, indent=2)
+        os.replace(tmp, self.path)
+        self.loaded_mtime = os.stat(self.path).st_mtime_ns
+
+    def _refresh(self):
+        """Reload if another process saved since we last did (lock held)."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return
+        if mtime != self.loaded_mtime:
+            self.queries = self._load()
+
+    # --- Saved queries ---
+
+    def add(self, tags, interval=None, auto_download=False):
+        """Save (or update) a query. Raises ValueError for a bad interval."""
+        tags = ' '.join(tags.split())
+        interval = parse_interval(interval, self.default_interval)
+        with self.lock:
+            self._refresh()
+            entry = self.queries.setdefault(tags, {
+                'max_id': 0,          # Highest post ID seen
+                'baselined': False,   # First poll done; later posts count as new
+                'catching_up': False, # Last delta filled a whole page
+                'last_poll': 0,
+                'new_total': 0,
+            })
+            entry['interval'] = interval
+            entry['auto_download'] = bool(auto_download)
+            self._save()
+        self.wakeup.set()
+        return dict(entry, tags=tags)
+
+    def remove(self, tags):
+        tags = ' '.join(tags.split())
+        with self.lock:
+            self._refresh()
+            removed = self.queries.pop(tags, None) is not None
+            self.recent.pop(tags, None)
+            if removed:
+                self._save()
+        return removed
+
+    def list(self):
+        with self.lock:
+            self._refresh()
+            return [dict(entry, tags=tags) for tags, entry in self.queries.items()]
+
+    def recent_items(self, tags):
+        with self.lock:
+            return list(self.recent.get(' '.join(tags.split()), ()))
+
+    # --- Polling ---
+
+    def _next_due(self, now):
+        """Most overdue query, or (None, seconds until the next one is due)."""
+        best, best_due = None, None
+        for tags, entry in self.queries.items():
+            # Unfinished catch-ups continue right away
+            due = entry['last_poll'] + (0 if entry['catching_up'] else entry['interval'])
+            if best_due is None or due < best_due:
+                best, best_due = tags, due
+        if best is None:
+            return None, self.default_interval
+        if best_due > now:
+            return None, best_due - now
+        return best, 0
+
+    def poll(self, tags):
+        """One delta request for tags. Returns the new items found."""
+        with self.lock:
+            entry = self.queries.get(tags)
+            if entry is None:
+                return []
+            max_id, baseline = entry['max_id'], not entry['baselined']
+
+        if max_id:
+            # Oldest-first so a full page leaves no gap before the next delta
+            data = CLIENT.search(f"{tags} id:>{max_id} sort:id:asc", page=0, limit=PAGE_LIMIT)
+        else:
+            data = CLIENT.search(tags, page=0, limit=PAGE_LIMIT)
+        WATCH_POLLS.inc()
+        items = [i for i in format_posts(data) if (i.id or 0) > max_id]
+
+        with self.lock:
+            entry = self.queries.get(tags)
+            if entry is None:
+                return []
+            entry['last_poll'] = time.time()
+            if items:
+                entry['max_id'] = max(entry['max_id'], max(i.id for i in items))
+            # The first poll only records where we are
+            entry['baselined'] = True
+            entry['catching_up'] = not baseline and len(data) >= PAGE_LIMIT
+            if not baseline:
+                entry['new_total'] += len(items)
+                self.recent.setdefault(tags, deque(maxlen=RECENT_ITEMS)).extendleft(items)
+            auto_download = entry['auto_download']
+            self._save()
+
+        if items:
+            LOCAL_INDEX.record(tags, 'rule34', None, items)
+        if baseline:
+            print(f"[Watch] {tags}: baseline at post {entry['max_id']}")
+            return []
+        if items:
+            WATCH_NEW_ITEMS.inc(amount=len(items))
+            print(f"[Watch] {tags}: {len(items)} new posts")
+            if auto_download and self.on_new_items:
+                self.on_new_items(tags, items)
+        return items
+
+    def _run(self):
+        while True:
+            tags = None
+            try:
+                with self.lock:
+                    self._refresh()
+                    tags, wait = self._next_due(time.time())
+                if tags is None:
+                    self.wakeup.wait(min(wait, REFRESH_INTERVAL))
+                    self.wakeup.clear()
+                    continue
+                self.poll(tags)
+            except Exception as e:
+                # Nothing may end this thread; start() never restarts it
+                print(f"[Watch] Poll failed for {tags}: {e}")
+                with self.lock:
+                    if tags in self.queries:
+                        self.queries[tags]['last_poll'] = time.time()
+            time.sleep(self.poll_gap)
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='watchlist', daemon=True)
+                self.thread.start()
+
+
+WATCHLIST = WatchList()
@@ -0,0 +1,148 @@
+"""
+Streaming ZIP export.
+
+stream_zip() yields a ZIP archive chunk by chunk while the images are still
+being fetched from upstream. A few entries are fetched ahead concurrently,
+each into a small bounded queue, so memory stays constant regardless of
+archive size: no temp files and no whole images in memory. Entries that fail
+are listed in manifest.json at the end of the archive instead of aborting.
+"""
+import io
+import json
+import queue
+import threading
+import zipfile
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from metrics import DOWNLOAD_BYTES, DOWNLOADS_IN_FLIGHT
+from bandwidth import SCHEDULER, QueueTimeout
+
+CHUNK_SIZE = 65536
+QUEUE_CHUNKS = 8 # Per-entry read-ahead: QUEUE_CHUNKS * CHUNK_SIZE bytes
+FETCH_TIMEOUT = 15
+
+
+class _Sink(io.RawIOBase):
+    """Unseekable file object that collects what zipfile writes until drained."""
+    def __init__(self):
+        self.parts = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        """Yield pending bytes as one chunk (nothing if empty)."""
+        if self.parts:
+            data = b''.join(self.parts)
+            self.parts = []
+            yield data
+
+
+def _entry_name(url, index, used):
+    filename = url.split('/')[-1].split('?')[0]
+    filename = "".join([c for c in filename if c.isalpha() or c.isdigit() or c in '._- ']).strip()
+    if not filename or len(filename) > 100:
+        filename = f"image_{index}.jpg"
+    if '.' not in filename:
+        filename += ".jpg"
+
+    # Avoid duplicate names inside the archive
+    name = filename
+    base_name, ext = filename.rsplit('.', 1)
+    counter = 1
+    while name in used:
+        name = f"{base_name}_{counter}.{ext}"
+        counter += 1
+    used.add(name)
+    return name
+
+
+def _put(q, item, cancel):
+    while not cancel.is_set():
+        try:
+            q.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _fetch_into(url, q, cancel, headers, owner):
+    """Worker: stream url into q as ('data', bytes) items, then ('end'|'error', ...)."""
+    try:
+        with SCHEDULER.acquire('bulk', owner, url, cancel=cancel) as transfer, \
+             requests.get(url, headers=headers, stream=True, timeout=FETCH_TIMEOUT) as res:
+            res.raise_for_status()
+            if not _put(q, ('start', None), cancel):
+                return
+            for chunk in transfer.throttle(res.iter_content(chunk_size=CHUNK_SIZE)):
+                if not _put(q, ('data', chunk), cancel):
+                    return
+        _put(q, ('end', None), cancel)
+    except QueueTimeout:
+        return # Export was cancelled while waiting for a slot
+    except Exception as e:
+        _put(q, ('error', str(e)), cancel)
+
+
+def stream_zip(urls, headers=None, workers=4, owner='export'):
+    """Generator of ZIP archive bytes for urls, fetched `workers` at a time."""
+    cancel = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='zip')
+    queues = {}
+
+    def submit(i):
+        if i < len(urls):
+            queues[i] = queue.Queue(maxsize=QUEUE_CHUNKS)
+            executor.submit(_fetch_into, urls[i], queues[i], cancel, headers, owner)
+
+    sink = _Sink()
+    zf = zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED)
+    manifest = []
+    used = set()
+    DOWNLOADS_IN_FLIGHT.inc('export')
+    try:
+        for i in range(min(workers, len(urls))):
+            submit(i)
+
+        for i, url in enumerate(urls):
+            q = queues.pop(i)
+            entry = {'index': i, 'url': url, 'status': 'success', 'bytes': 0}
+            kind, value = q.get()
+            if kind == 'error':
+                entry.update(status='error', error=value)
+            else:
+                entry['name'] = _entry_name(url, i, used)
+                with zf.open(entry['name'], 'w') as dest:
+                    while True:
+                        kind, value = q.get()
+                        if kind == 'data':
+                            dest.write(value)
+                            entry['bytes'] += len(value)
+                            DOWNLOAD_BYTES.inc('export', amount=len(value))
+                            yield from sink.drain()
+                        else:
+                            break
+                if kind == 'error':
+                    # Partial data is already streamed; keep the entry but flag it
+                    entry.update(status='truncated', error=value)
+            manifest.append(entry)
+            submit(i + workers)
+            yield from sink.drain()
+
+        zf.writestr('manifest.json', json.dumps({
+            'total': len(urls),
+            'succeeded': sum(1 for e in manifest if e['status'] == 'success'),
+            'entries': manifest,
+        }, indent=2))
+        zf.close()
+        yield from sink.drain()
+    finally:
+        # Also runs when the client disconnects mid-download
+        cancel.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+        DOWNLOADS_IN_FLIGHT.dec('export')